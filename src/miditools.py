@@ -5,6 +5,8 @@
     Author: Coolbrother
 """
 
+import numpy as np
+
 # Midi notes numbers: from 0 to 127
 # Midi notes names: from C-1 to G9
 
@@ -16,6 +18,10 @@ _note_names = [
 
 _note_lst = []
 _freq_lst = []
+_note_dic = {} # note name: midi number
+_freq_arr = None # freqs table of the default tuning
+_tuning_dic = {} # tuning tables by (a4, cents)
+_ref_a4 = 440.0
 
 def limit_value(val, min_val=0, max_val=127):
     if val < min_val: return min_val
@@ -33,25 +39,83 @@ def _init_noteList():
 #-----------------------------------------
 
 def _init_noteFreq():
-    """ initializing notes and freqs list """
-    global _note_lst, _freq_lst
-    _note_lst = []; _freq_lst = []
-    count =0
-    for i in range(-1, 10):
-        for name in _note_names:
-            _note_lst.append(name + str(i))
-            _freq_lst.append(mid2freq(count))
-            count += 1
-            if count > 127:
-                return
+    """ initializing notes and freqs tables """
+    global _note_lst, _freq_lst, _note_dic, _freq_arr
+    _init_noteList()
+    _note_dic = {name: i for (i, name) in enumerate(_note_lst)}
+    _freq_arr = make_tuning()
+    _freq_lst = _freq_arr.tolist()
+
+#-----------------------------------------
+
+def make_tuning(a4=_ref_a4, cents=None):
+    """
+    returns read only table of the 128 midi notes freqs,
+    with a4 as reference, and cents offsets by pitch class (12 values, from C),
+    or by note (128 values). Computed once by tuning
+    """
+    key = (float(a4), None if cents is None else tuple(cents))
+    tuning = _tuning_dic.get(key)
+    if tuning is None:
+        semi_arr = np.arange(128, dtype=np.float64)
+        if cents is not None:
+            cent_arr = np.asarray(cents, dtype=np.float64)
+            if len(cent_arr) == 12:
+                cent_arr = np.resize(cent_arr, 128)
+            elif len(cent_arr) != 128:
+                raise ValueError("cents must have 12 or 128 values")
+            semi_arr += cent_arr / 100
+        tuning = a4 * np.exp2((semi_arr - 69) / 12)
+        tuning.flags.writeable = False
+        _tuning_dic[key] = tuning
+
+    return tuning
 
 #-----------------------------------------
 
-def mid2freq(val):
-    """ returns freq from midi note number """
-    ref = 440.0/32 # 13.75 Hz, note A-1
-    # we substract -9 for getting C-1 note name
-    return ref * pow(2, (int(val) - 9) * 1/12.0)
+def mid2freq(val, tuning=None):
+    """
+    returns freq from midi note number,
+    or array of freqs from array of midi numbers
+    """
+    if tuning is None: tuning = _freq_arr
+    if isinstance(val, (int, float, np.number)):
+        val = int(val)
+        if 0 <= val <= 127:
+            if tuning is _freq_arr: return _freq_lst[val]
+            return float(tuning[val])
+        # out of the table, equal temperament from A4
+        return float(tuning[69]) * pow(2, (val - 69) / 12.0)
+    mid_arr = np.asarray(val).astype(np.int64)
+    freq_arr = np.take(tuning, np.clip(mid_arr, 0, 127))
+    out_mask = (mid_arr < 0) | (mid_arr > 127)
+    if out_mask.any():
+        freq_arr[out_mask] = tuning[69] * np.exp2((mid_arr[out_mask] - 69) / 12)
+    
+    return freq_arr
+
+#-----------------------------------------
+
+def freq2mid(freq, tuning=None):
+    """
+    returns fractional midi number from freq, or array from array of freqs,
+    interpolated in the tuning table, so it inverts mid2freq with its cents.
+    Rounding it gives the nearest note, 0 for freqs not above 0
+    """
+    if tuning is None: tuning = _freq_arr
+    is_scalar = isinstance(freq, (int, float, np.number))
+    freq_arr = np.asarray(freq, dtype=np.float64)
+    valid_mask = freq_arr > 0
+    log_arr = np.log2(tuning)
+    log_freq = np.log2(np.where(valid_mask, freq_arr, 1.0))
+    mid_arr = np.interp(log_freq, log_arr, np.arange(len(tuning), dtype=np.float64))
+    # out of the table, equal temperament from A4, like mid2freq
+    out_mask = (log_freq < log_arr[0]) | (log_freq > log_arr[-1])
+    mid_arr = np.where(out_mask, 69 + 12 * (log_freq - log_arr[69]), mid_arr)
+    mid_arr = np.where(valid_mask, mid_arr, 0.0)
+    if is_scalar: return float(mid_arr)
+
+    return mid_arr
 
 #-----------------------------------------
 
@@ -66,25 +130,21 @@ def mid2note(val):
 #-----------------------------------------
 
 def note2mid(name):
-    """ convert note name to midi note number """
-    try:
-        return _note_lst.index(name.upper())
-    except IndexError:
-        return 0
+    """ convert note name to midi note number, 0 if unknown """
+    return _note_dic.get(name.upper(), 0)
 
 #-----------------------------------------
 
 def note2freq(name):
-    """ convert note name to freq """
-    try:
-        val = _note_lst.index(name.upper())
-        return _freq_lst[val]
-    except IndexError:
-        return 0
+    """ convert note name to freq, 0 if unknown """
+    val = _note_dic.get(name.upper())
+    if val is None: return 0
+    
+    return _freq_lst[val]
 
 #-----------------------------------------
 
-# initializing note freq dic
+# initializing note freq tables
 _init_noteFreq()
 def test():
     hz = note2freq
@@ -0,0 +1,426 @@
+#! /usr/bin/env python3
+"""
+    File: stepybench.py
+    Benchmark suite for the render paths of Stepyseq,
+    running headless with the null driver.
+    Reports ns by block, allocated bytes by block, and percent of the realtime budget.
+    Results can be saved in json, and compared with a previous run.
+    The allocation check runs first, the exit status is 1 if it failed.
+    Date: Mon, 15/11/2021
+    Author: Coolbrother
+"""
+
+import sys
+import time
+import json
+import platform
+import subprocess
+import tracemalloc
+import itertools
+import argparse
+import importlib.util
+import py_compile
+import numpy as np
+import stepyseq
+
+_NB_BLOCKS = 200
+_NB_REPEATS = 5
+# modules loaded only by the PortAudio driver, the interactive front-end,
+# the control server and the batch mode
+_LAZY_MODULES = ("pyaudio", "curses", "readline", "timeit", "asyncio", "multiprocessing")
+_IMPORT_BUDGET_MS = 50 # import time of stepyseq, without numpy
+
+#------------------------------------------------------------------------------
+
+def make_manager(nb_tracks=1, nb_steps=4, frame_count=960, synth="prerender", quant_len=0):
+    """ returns audio manager with a pattern, without sound card """
+    audi_man = stepyseq.AudioManager("null", frame_count=frame_count)
+    audi_man.print_info = lambda msg: None
+    audi_man.set_synthMode(synth)
+    audi_man.init_pattern(nb_tracks=nb_tracks, nb_steps=nb_steps)
+    if quant_len:
+        audi_man.change_quantizeLen(quant_len)
+    audi_man.init_pos()
+    audi_man.get_ringBuffer().reset()
+
+    return audi_man
+
+#------------------------------------------------------------------------------
+
+def get_budgetNs(audi_man):
+    """ returns the block duration in ns """
+    return audi_man.get_frameCount() / audi_man.get_rate() * 1e9
+
+#------------------------------------------------------------------------------
+
+def time_func(func, nb_calls=_NB_BLOCKS, nb_repeats=_NB_REPEATS):
+    """ returns min time by call in ns, over nb_repeats """
+    # warmup
+    for _ in range(min(nb_calls, 20)):
+        func()
+    time_lst = []
+    for _ in range(nb_repeats):
+        start = time.perf_counter_ns()
+        for _ in range(nb_calls):
+            func()
+        time_lst.append((time.perf_counter_ns() - start) / nb_calls)
+
+    return min(time_lst)
+
+#------------------------------------------------------------------------------
+
+def measure_allocs(func, nb_calls=50):
+    """ returns mean of the peak bytes allocated by call, with tracemalloc """
+    func()
+    tracemalloc.start()
+    try:
+        total =0
+        for _ in range(nb_calls):
+            tracemalloc.reset_peak()
+            (cur, _) = tracemalloc.get_traced_memory()
+            func()
+            (_, peak) = tracemalloc.get_traced_memory()
+            total += peak - cur
+    finally:
+        tracemalloc.stop()
+
+    return total / nb_calls
+
+#------------------------------------------------------------------------------
+
+def bench_case(name, func, budget_ns=0, nb_calls=_NB_BLOCKS, nb_repeats=_NB_REPEATS):
+    """ returns result dict of a case """
+    ns = time_func(func, nb_calls, nb_repeats)
+    alloc = measure_allocs(func, min(nb_calls, 50))
+    res = {
+            "name": name,
+            "ns": ns,
+            "alloc_bytes": alloc,
+            "budget_pct": ns / budget_ns * 100 if budget_ns else None,
+            }
+
+    return res
+
+#------------------------------------------------------------------------------
+
+def callback_func(audi_man, render_func):
+    """ returns the callback body: render, then read a block """
+    def func():
+        render_func()
+        audi_man.get_bufData()
+
+    return func
+
+#------------------------------------------------------------------------------
+
+def bench_renderPaths(nb_blocks=_NB_BLOCKS):
+    """ poll_audio and the render_audio implementations, by block """
+    res_lst = []
+    audi_man = make_manager()
+    budget = get_budgetNs(audi_man)
+    res_lst.append(bench_case("poll_audio", audi_man.poll_audio, budget, nb_blocks))
+    for name in ("render_audio", "render_audio2", "render_audio4"):
+        audi_man = make_manager()
+        if name == "render_audio4":
+            audi_man.get_playPattern().gen_byteList()
+        func = callback_func(audi_man, getattr(audi_man, name))
+        res_lst.append(bench_case(name, func, budget, nb_blocks))
+    audi_man = make_manager(synth="stream")
+    func = callback_func(audi_man, audi_man.render_audio)
+    res_lst.append(bench_case("render_audio stream", func, budget, nb_blocks))
+
+    return res_lst
+
+#------------------------------------------------------------------------------
+
+def bench_generators(nb_calls=20):
+    """ gen_audio of a pattern, and WaveGenerator.gen_samples, by call """
+    res_lst = []
+    audi_man = make_manager(nb_steps=16)
+    pat = audi_man.get_pattern()
+    res_lst.append(bench_case("gen_audio 16 steps", pat.gen_audio, 0, nb_calls))
+    wave_gen = stepyseq.WaveGenerator(48000)
+    def gen_uncached():
+        wave_gen.clear_cache()
+        wave_gen.gen_samples(440, 6)
+    res_lst.append(bench_case("gen_samples 6 secs", gen_uncached, 0, nb_calls))
+    def gen_cached():
+        wave_gen.gen_samples(440, 6)
+    res_lst.append(bench_case("gen_samples 6 secs cached", gen_cached, 0, nb_calls))
+
+    return res_lst
+
+#------------------------------------------------------------------------------
+
+def bench_edits(nb_calls=20):
+    """ edits published to the played snapshot, by call, for small and large patterns """
+    res_lst = []
+    for (nb_tracks, nb_steps) in ((1, 4), (8, 2048)):
+        audi_man = make_manager(nb_tracks=nb_tracks, nb_steps=nb_steps)
+        count = [0]
+        def edit_note():
+            # a few notes, the synthesis being cached
+            count[0] +=1
+            audi_man.change_note(count[0] % nb_steps, 60 + count[0] % 4)
+        def edit_bpm():
+            count[0] +=1
+            audi_man.change_bpm(100 + count[0] % 4)
+        size = f"{nb_tracks}x{nb_steps}"
+        res_lst.append(bench_case(f"change_note {size}", edit_note, 0, nb_calls))
+        res_lst.append(bench_case(f"change_bpm {size}", edit_bpm, 0, nb_calls))
+
+    return res_lst
+
+#------------------------------------------------------------------------------
+
+def bench_scaling(nb_blocks=_NB_BLOCKS):
+    """ render_audio with steps count, tracks count, and block size """
+    res_lst = []
+    for nb_steps in (4, 16, 64):
+        audi_man = make_manager(nb_steps=nb_steps)
+        func = callback_func(audi_man, audi_man.render_audio)
+        res_lst.append(bench_case(f"steps {nb_steps}", func, get_budgetNs(audi_man), nb_blocks))
+    for nb_tracks in (1, 8, 64):
+        audi_man = make_manager(nb_tracks=nb_tracks)
+        func = callback_func(audi_man, audi_man.render_audio)
+        res_lst.append(bench_case(f"tracks {nb_tracks}", func, get_budgetNs(audi_man), nb_blocks))
+    for frame_count in (64, 256, 960, 4096):
+        audi_man = make_manager(frame_count=frame_count)
+        func = callback_func(audi_man, audi_man.render_audio)
+        res_lst.append(bench_case(f"block {frame_count}", func, get_budgetNs(audi_man), nb_blocks))
+
+    return res_lst
+
+#------------------------------------------------------------------------------
+
+def get_importTimes(module="stepyseq"):
+    """
+    returns dict of the cumulative import times in ms, by module,
+    and the lazy modules loaded by importing module, in a new interpreter
+    """
+    code = (f"import {module}, sys; "
+            f"print(','.join(m for m in {_LAZY_MODULES!r} if m in sys.modules))")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True, text=True, timeout=60)
+    time_dic = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit(): continue
+        time_dic[fields[2].strip()] = int(fields[1]) / 1000
+    loaded_lst = [name for name in proc.stdout.strip().split(",") if name]
+
+    return (time_dic, loaded_lst)
+
+#------------------------------------------------------------------------------
+
+def check_importTime(budget_ms=_IMPORT_BUDGET_MS, module="stepyseq"):
+    """
+    regression check for the startup time
+    returns list of errors, empty when passed
+    """
+    # bytecode cache written, even with PYTHONDONTWRITEBYTECODE
+    spec = importlib.util.find_spec(module)
+    py_compile.compile(spec.origin)
+    (time_dic, loaded_lst) = get_importTimes(module)
+    err_lst = []
+    if loaded_lst:
+        err_lst.append(f"{module} imports lazy modules: {', '.join(loaded_lst)}")
+    # numpy import time does not depend on us
+    dur = time_dic.get(module, 0) - time_dic.get("numpy", 0)
+    print(f"Import time of {module}: {time_dic.get(module, 0):.1f} ms, "
+            f"without numpy: {dur:.1f} ms, budget: {budget_ms} ms")
+    if dur > budget_ms:
+        err_lst.append(f"{module} import takes {dur:.1f} ms, budget: {budget_ms} ms")
+    for err in err_lst:
+        print(f"Error: {err}")
+
+    return err_lst
+
+#------------------------------------------------------------------------------
+
+def trace_blocks(func, nb_blocks):
+    """ returns (kept, transient) bytes of nb_blocks calls of func, after a first traced pass """
+    for _ in range(nb_blocks):
+        func()
+    tracemalloc.start()
+    try:
+        # first traced pass, for the objects replaced at each block
+        for _ in range(nb_blocks):
+            func()
+        # the loop iterator allocated before the checkpoint
+        block_iter = itertools.repeat(None, nb_blocks)
+        (start, _) = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for _ in block_iter:
+            func()
+        (cur, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return (cur - start, peak - start)
+
+#------------------------------------------------------------------------------
+
+def count_ringSlots(audi_man, nb_cycles=2):
+    """
+    returns the number of distinct (write, read, read_bytes) objects of the ring buffer,
+    over nb_cycles of its capacity, and its number of slots
+    """
+    ring = audi_man.get_ringBuffer()
+    frame_count = audi_man.get_frameCount()
+    nb_slots = ring.get_capacity() // frame_count
+    ring.reset()
+    (write_lst, read_lst, byte_lst) = ([], [], [])
+    # kept alive, so new objects have new ids
+    for (read_func, obj_lst) in ((ring.read, read_lst), (ring.read_bytes, byte_lst)):
+        for _ in range(nb_cycles * nb_slots):
+            write_lst.append(ring.get_writeBuffer(frame_count))
+            ring.commit(frame_count)
+            obj_lst.append(read_func(frame_count))
+    ring.reset()
+    
+    return (tuple(len(set(map(id, lst))) for lst in (write_lst, read_lst, byte_lst)), nb_slots)
+
+#------------------------------------------------------------------------------
+
+def check_allocs(nb_blocks=_NB_BLOCKS):
+    """
+    regression check for the allocations of the render stage, with tracemalloc,
+    on blocks aligned on the steps: no memory kept, and mixing the tracks
+    allocates nothing more than an empty mix, all tracks muted.
+    CPython boxes the sample positions of the ring buffer and the scheduler as ints,
+    the same in both mixes, so the ring buffer is checked by its objects:
+    one view and one bytes object by slot, created once
+    returns list of errors, empty when passed
+    """
+    case_lst = [
+            ("prerender", {}),
+            ("stream", {"synth": "stream"}),
+            ("tracks 8", {"nb_tracks": 8}),
+            ("quantize", {"quant_len": 4}),
+            # divides the step length, the 4096 max does not
+            ("block 2400", {"frame_count": 2400}),
+            ]
+    err_lst = []
+    for (name, kwargs) in case_lst:
+        audi_man = make_manager(**kwargs)
+        (kept, peak) = trace_blocks(callback_func(audi_man, audi_man.render_audio), nb_blocks)
+        empty_man = make_manager(**kwargs)
+        pat = empty_man.get_playPattern()
+        for track in pat.get_trackList():
+            track.set_muted(True)
+        pat.update_gains()
+        (empty_kept, empty_peak) = trace_blocks(callback_func(empty_man, empty_man.render_audio), nb_blocks)
+        transient = peak - empty_peak
+        print(f"Allocs {name}: kept: {kept} B, transient: {transient} B, empty mix peak: {empty_peak} B")
+        if kept != 0 or empty_kept != 0:
+            err_lst.append(f"{name}: {kept} bytes kept after {nb_blocks} blocks, {empty_kept} for the empty mix")
+        if transient != 0:
+            err_lst.append(f"{name}: peak of {peak} bytes by block, {empty_peak} for the empty mix")
+        (count_lst, nb_slots) = count_ringSlots(audi_man)
+        if any(count != nb_slots for count in count_lst):
+            err_lst.append(f"{name}: ring buffer objects (write, read, read_bytes): {count_lst}, for {nb_slots} slots")
+    for err in err_lst:
+        print(f"Error: {err}")
+
+    return err_lst
+
+#------------------------------------------------------------------------------
+
+def get_commit():
+    """ returns the current git commit, or empty string """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+#------------------------------------------------------------------------------
+
+def run_suite(nb_blocks=_NB_BLOCKS):
+    """ returns results dict of the whole suite """
+    group_dic = {
+            "render": bench_renderPaths(nb_blocks),
+            "generators": bench_generators(),
+            "edits": bench_edits(),
+            "scaling": bench_scaling(nb_blocks),
+            }
+
+    return {
+            "commit": get_commit(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "groups": group_dic,
+            }
+
+#------------------------------------------------------------------------------
+
+def print_results(results, old_results=None):
+    """ print results table, with the change against old_results """
+    old_dic = {}
+    if old_results:
+        for (group, res_lst) in old_results["groups"].items():
+            for res in res_lst:
+                old_dic[(group, res["name"])] = res
+        print(f"Compared with commit: {old_results.get('commit', '')}")
+    print(f"Commit: {results['commit']}, python: {results['python']}, numpy: {results['numpy']}")
+    for (group, res_lst) in results["groups"].items():
+        print(f"\n{group}")
+        for res in res_lst:
+            pct = res["budget_pct"]
+            pct_str = f"{pct:7.2f} %" if pct is not None else " " * 9
+            line = f"  {res['name']:<28} {res['ns']:>12.0f} ns  {res['alloc_bytes']:>10.0f} B  {pct_str}"
+            old = old_dic.get((group, res["name"]))
+            if old:
+                line += f"  {(res['ns'] / old['ns'] - 1) * 100:+7.1f} %"
+            print(line)
+
+#------------------------------------------------------------------------------
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark suite for Stepyseq render paths")
+    parser.add_argument("-n", "--blocks", type=int, default=_NB_BLOCKS,
+            help="number of blocks by measure")
+    parser.add_argument("-j", "--json", metavar="FILE",
+            help="save results in json file")
+    parser.add_argument("-c", "--compare", metavar="FILE",
+            help="compare with results from json file")
+    parser.add_argument("--check-import", action="store_true",
+            help="only check the import time, returns 1 if failed")
+    parser.add_argument("--check-allocs", action="store_true",
+            help="only check the allocations by block, returns 1 if failed")
+    parser.add_argument("--no-check", action="store_true",
+            help="skip the allocation check before the suite")
+
+    return parser.parse_args(argv)
+
+#------------------------------------------------------------------------------
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.check_import:
+        return 1 if check_importTime() else 0
+    if args.check_allocs:
+        return 1 if check_allocs(args.blocks) else 0
+    # pass or fail, before the timings
+    failed = False if args.no_check else bool(check_allocs(args.blocks))
+    results = run_suite(args.blocks)
+    old_results = None
+    if args.compare:
+        with open(args.compare) as f:
+            old_results = json.load(f)
+    print_results(results, old_results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    return 1 if failed else 0
+
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    sys.exit(main())
+#------------------------------------------------------------------------------
@@ -7,25 +7,41 @@
 """
 
 import os
+import sys
 import math
 import time
+import struct
+import argparse
+import threading
+import queue
+import json
+import hashlib
+from bisect import bisect_left
+from collections import OrderedDict
 import numpy as np
-import pyaudio
-from collections import deque
 import miditools
-import timeit
-import readline
-import curses
+from miditools import limit_value
 
-
-_pa = pyaudio.PyAudio()
+# pyaudio, readline and curses are imported on demand,
+# only by the PortAudio driver and the interactive front-end
+curses = None # imported by MainWindow
+_pa = None # PyAudio instance, created by the first PortDriver
 
 _HISTORY_TEMPFILE = "/tmp/.synth_history"
+# 0-d array operand of the oscillators, a float would be converted by block
+_TWO_PI = np.array(2 * np.pi)
+_TWO_PI.flags.writeable = False
+
+# PortAudio callback return code, and status flags
+_paContinue =0
+_paOutputUnderflow = 0x4
+_paOutputOverflow = 0x8
 
 def read_historyfile(filename=""):
     if not filename:
         filename = _HISTORY_FILENAME
     if os.path.exists(filename):
+        import readline
         readline.read_history_file(filename)
         # print('Max history file length:', readline.get_history_length())
         # print('Startup history:', get_history_items())
@@ -36,144 +52,2128 @@ def write_historyfile(filename=""):
     # print('Final history:', get_history_items())
     if not filename:
         filename = _HISTORY_FILENAME
+    import readline
     readline.write_history_file(filename)
 
 #------------------------------------------------------------------------------
 
+class WavWriter(object):
+    """ write float32 samples to a wav file, in IEEE float format """
+    def __init__(self, filename="", rate=48000, channels=1):
+        self._filename = filename
+        self._rate = rate
+        self._channels = channels
+        self._file = None
+        self._dataLen =0
+
+    #-------------------------------------------
+
+    def open(self):
+        self._file = open(self._filename, "wb")
+        self._dataLen =0
+        self.write_header()
+
+    #-------------------------------------------
+
+    def write_header(self):
+        """ RIFF header with fmt chunk, format 3 for float """
+        assert self._file
+        samp_bytes =4
+        block_align = self._channels * samp_bytes
+        header = struct.pack("<4sI4s4sIHHIIHH4sI",
+                b"RIFF", 36 + self._dataLen, b"WAVE",
+                b"fmt ", 16, 3, self._channels, self._rate,
+                self._rate * block_align, block_align, samp_bytes * 8,
+                b"data", self._dataLen)
+        self._file.seek(0)
+        self._file.write(header)
+        self._file.seek(0, os.SEEK_END)
+
+    #-------------------------------------------
+
+    def write(self, data):
+        """ write bytes or float32 array """
+        assert self._file
+        self._file.write(data)
+        self._dataLen += memoryview(data).nbytes
+
+    #-------------------------------------------
+
+    def close(self):
+        if self._file:
+            # update the chunk sizes
+            self.write_header()
+            self._file.close()
+            self._file = None
+
+    #-------------------------------------------
+
+#========================================
+
+class BufferWriter(object):
+    """ write float32 samples to an array, like WavWriter, for rendering in shared memory """
+    def __init__(self, arr):
+        self._arr = arr
+        self._pos =0
+
+    #-------------------------------------------
+
+    def write(self, data):
+        """ write bytes or float32 array, up to the array end """
+        data = np.frombuffer(data, dtype=np.float32)
+        nb = min(len(data), len(self._arr) - self._pos)
+        self._arr[self._pos:self._pos+nb] = data[0:nb]
+        self._pos += nb
+
+    #-------------------------------------------
+
+    def get_pos(self):
+        return self._pos
+
+    #-------------------------------------------
+
+#========================================
+
+class RingBuffer(object):
+    """
+    Single producer, single consumer ring buffer of float32 frames.
+    The consumer gets zero copy views, released at its next read,
+    so the producer never overwrites a block still used by the driver.
+    The views of the blocks are created once, none by block read or written.
+    """
+    def __init__(self, capacity=2880, frame_count=960):
+        # capacity in frames, multiple of frame_count, so a block never wraps
+        # at least 2 blocks: one used by the consumer, one to be written
+        nb_blocks = max(2, math.ceil(capacity / frame_count))
+        self._frameCount = frame_count
+        self._capacity = nb_blocks * frame_count
+        self._buf = np.zeros(self._capacity, dtype=np.float32)
+        self._blockLst = [self._buf[i:i+frame_count] for i in range(0, self._capacity, frame_count)]
+        self._byteLst = [memoryview(block).toreadonly() for block in self._blockLst]
+        self._writeIndex =0 # total frames written
+        self._readIndex =0 # total frames released by the consumer
+        self._pendingLen =0 # frames read but not yet released
+
+    #-------------------------------------------
+
+    def get_capacity(self):
+        return self._capacity
+
+    #-------------------------------------------
+
+    def get_readSpace(self):
+        """ returns number of frames available for reading """
+        return self._writeIndex - self._readIndex - self._pendingLen
+
+    #-------------------------------------------
+
+    def get_writeSpace(self):
+        """ returns number of frames available for writing """
+        return self._capacity - (self._writeIndex - self._readIndex)
+
+    #-------------------------------------------
+
+    def write(self, data):
+        """ copy frames to the buffer, returns number of frames written """
+        nb_frames = min(len(data), self.get_writeSpace())
+        if nb_frames <= 0: return 0
+        pos = self._writeIndex % self._capacity
+        first = min(nb_frames, self._capacity - pos)
+        if first == len(data):
+            # whole block, without slicing data
+            self._buf[pos:pos+first] = data
+        else:
+            self._buf[pos:pos+first] = data[0:first]
+        if first < nb_frames:
+            self._buf[0:nb_frames-first] = data[first:nb_frames]
+        # publish the frames after copying them
+        self._writeIndex += nb_frames
+        
+        return nb_frames
+
+    #-------------------------------------------
+
+    def get_writeBuffer(self, nb_frames=0):
+        """
+        returns a writable view of the next nb_frames to write in place,
+        or None if not available, published by commit
+        """
+        if nb_frames == 0:
+            nb_frames = self._frameCount
+        if self.get_writeSpace() < nb_frames: return
+        pos = self._writeIndex % self._capacity
+        if pos + nb_frames > self._capacity: return
+        if nb_frames == self._frameCount and pos % nb_frames == 0:
+            return self._blockLst[pos // nb_frames]
+        
+        return self._buf[pos:pos+nb_frames]
+
+    #-------------------------------------------
+
+    def commit(self, nb_frames):
+        """ publish the frames written in the buffer given by get_writeBuffer """
+        self._writeIndex += nb_frames
+
+    #-------------------------------------------
+
+    def take_readPos(self, nb_frames):
+        """
+        returns the position of the nb_frames to read, or None if not available,
+        the previous view is released
+        """
+        self.release()
+        if self.get_readSpace() < nb_frames: return
+        pos = self._readIndex % self._capacity
+        if pos + nb_frames > self._capacity: return
+        self._pendingLen = nb_frames
+
+        return pos
+
+    #-------------------------------------------
+
+    def read(self, nb_frames=0):
+        """
+        returns a read only view of nb_frames, or None if not available
+        the previous view is released
+        """
+        if nb_frames == 0:
+            nb_frames = self._frameCount
+        pos = self.take_readPos(nb_frames)
+        if pos is None: return
+        if nb_frames == self._frameCount and pos % nb_frames == 0:
+            return self._blockLst[pos // nb_frames]
+        
+        return self._buf[pos:pos+nb_frames]
+
+    #-------------------------------------------
+
+    def read_bytes(self, nb_frames=0):
+        """ like read, as read only bytes like object for the driver """
+        if nb_frames == 0:
+            nb_frames = self._frameCount
+        pos = self.take_readPos(nb_frames)
+        if pos is None: return
+        if nb_frames == self._frameCount and pos % nb_frames == 0:
+            return self._byteLst[pos // nb_frames]
+        
+        return memoryview(self._buf[pos:pos+nb_frames]).toreadonly()
+
+    #-------------------------------------------
+
+    def release(self):
+        """ release the last view given to the consumer """
+        if self._pendingLen:
+            self._readIndex += self._pendingLen
+            self._pendingLen =0
+
+    #-------------------------------------------
+
+    def clear(self):
+        """ drop frames not yet read, called from the producer side """
+        self._writeIndex = self._readIndex + self._pendingLen
+
+    #-------------------------------------------
+
+    def reset(self):
+        """ empty the buffer, only when the stream is stopped """
+        self._writeIndex =0
+        self._readIndex =0
+        self._pendingLen =0
+
+    #-------------------------------------------
+
+#========================================
+
+class SessionFile(object):
+    """
+    session on disk: json metadata file, with the steps audio
+    in a npy sample bank, loaded as read only memory map
+    """
+    _version =1
+    def __init__(self, filename=""):
+        base = os.path.splitext(filename)[0]
+        self._metaFile = base + ".json"
+        self._bankFile = base + ".npy"
+
+    #-------------------------------------------
+
+    def get_metaFile(self):
+        return self._metaFile
+
+    #-------------------------------------------
+
+    def get_bankFile(self):
+        return self._bankFile
+
+    #-------------------------------------------
+
+    def save(self, meta_dic, buf_lst, dtype=np.float32):
+        """
+        write the buffers contiguous in the sample bank,
+        their positions in meta_dic["blocks"], as [offset, length]
+        files are replaced at once, not to disturb other readers
+        """
+        block_lst = []
+        pos =0
+        for buf in buf_lst:
+            block_lst.append([pos, len(buf)])
+            pos += len(buf)
+        meta_dic = dict(meta_dic, version=self._version, blocks=block_lst, bank="")
+        if pos:
+            tmp_file = self._bankFile + ".tmp.npy"
+            bank = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=dtype, shape=(pos,))
+            for (buf, (offset, nb)) in zip(buf_lst, block_lst):
+                bank[offset:offset+nb] = buf
+            bank.flush()
+            del bank
+            os.replace(tmp_file, self._bankFile)
+            meta_dic["bank"] = os.path.basename(self._bankFile)
+        tmp_file = self._metaFile + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(meta_dic, f, indent=2)
+        os.replace(tmp_file, self._metaFile)
+
+    #-------------------------------------------
+
+    def load_meta(self):
+        """ returns the metadata dict, without mapping the sample bank """
+        with open(self._metaFile) as f:
+            meta_dic = json.load(f)
+        if meta_dic.get("version", 0) > self._version:
+            raise ValueError(f"Session version not supported: {meta_dic['version']}")
+        
+        return meta_dic
+
+    #-------------------------------------------
+
+    def load(self):
+        """
+        returns (meta_dic, block_lst), blocks are views of the memory mapped bank,
+        paged in only when played, and shared by the processes reading it
+        """
+        meta_dic = self.load_meta()
+        block_lst = []
+        if meta_dic.get("bank"):
+            bank_file = os.path.join(os.path.dirname(self._metaFile), meta_dic["bank"])
+            bank = np.load(bank_file, mmap_mode="r")
+            block_lst = [bank[offset:offset+nb] for (offset, nb) in meta_dic["blocks"]]
+        
+        return (meta_dic, block_lst)
+
+    #-------------------------------------------
+
+#========================================
+
+class CallbackStats(object):
+    """
+    Statistics of the stream callback, recorded in the audio thread
+    with preallocated counters only
+    """
+    # histogram buckets, upper bounds in usec
+    _boundLst = [16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536]
+
+    def __init__(self, frame_count=960, rate=48000):
+        self._histLst = [0] * (len(self._boundLst) + 1) # last one for overflow
+        self.set_budget(frame_count, rate)
+
+    #-------------------------------------------
+
+    def set_budget(self, frame_count, rate):
+        """ deadline of the callback is the block duration """
+        self._budgetNs = int(frame_count / rate * 1e9)
+        self.reset()
+
+    #-------------------------------------------
+
+    def reset(self):
+        for i in range(len(self._histLst)):
+            self._histLst[i] =0
+        self._nbCallbacks =0
+        self._totalNs =0
+        self._maxNs =0
+        self._nbOverruns =0 # render time over the budget
+        self._nbUnderflows =0
+        self._nbOverflows =0
+        self._nbEmpty =0 # no data from the ring buffer
+
+    #-------------------------------------------
+
+    def record(self, dur_ns, status, is_empty):
+        """ called at the end of each callback """
+        self._nbCallbacks +=1
+        self._totalNs += dur_ns
+        if dur_ns > self._maxNs: self._maxNs = dur_ns
+        if dur_ns > self._budgetNs: self._nbOverruns +=1
+        if status & _paOutputUnderflow: self._nbUnderflows +=1
+        if status & _paOutputOverflow: self._nbOverflows +=1
+        if is_empty: self._nbEmpty +=1
+        self._histLst[bisect_left(self._boundLst, dur_ns // 1000)] +=1
+
+    #-------------------------------------------
+
+    def get_dict(self):
+        """ returns statistics in a dict, for printing or json """
+        nb = self._nbCallbacks
+        budget = self._budgetNs
+        mean_ns = self._totalNs / nb if nb else 0
+        bound_lst = [f"<={bound}us" for bound in self._boundLst] + [f">{self._boundLst[-1]}us"]
+        return {
+                "callbacks": nb,
+                "budget_us": budget / 1000,
+                "mean_us": mean_ns / 1000,
+                "max_us": self._maxNs / 1000,
+                "mean_load": mean_ns / budget if budget else 0,
+                "max_load": self._maxNs / budget if budget else 0,
+                "overruns": self._nbOverruns,
+                "underflows": self._nbUnderflows,
+                "overflows": self._nbOverflows,
+                "empty_buffers": self._nbEmpty,
+                "histogram": dict(zip(bound_lst, self._histLst)),
+                }
+
+    #-------------------------------------------
+
+    def dump_json(self, filename=""):
+        """ returns json string, written to filename if given """
+        data = json.dumps(self.get_dict(), indent=2)
+        if filename:
+            with open(filename, "w") as f:
+                f.write(data)
+        
+        return data
+
+    #-------------------------------------------
+
+#========================================
+
+class StepStore(object):
+    """
+    steps of a track in columns: numpy arrays for note, freq, velocity,
+    gate length and active flag, and lists for the audio buffers and the files
+    """
+    def __init__(self, nb_steps=0):
+        self._count =0
+        self._noteArr = np.zeros(0, dtype=np.int16)
+        self._freqArr = np.zeros(0, dtype=np.float64)
+        self._veloArr = np.zeros(0, dtype=np.float32)
+        self._gateArr = np.zeros(0, dtype=np.float32) # in fraction of the step length
+        self._activeArr = np.zeros(0, dtype=bool)
+        self._lenArr = np.zeros(0, dtype=np.float64) # audio length, in secs
+        self._dataLst = [] # audio buffers
+        self._fileLst = [] # wav files from the sample bank
+        self._viewLst = None # SampleObj views, built on demand
+        self.resize(nb_steps)
+
+    #-------------------------------------------
+
+    def __len__(self):
+        return self._count
+
+    #-------------------------------------------
+
+    def resize(self, nb_steps):
+        """ change the steps count, new steps are active, with velocity and gate at 1 """
+        count = self._count
+        if nb_steps > len(self._noteArr):
+            # doubling the capacity, for appending
+            size = max(nb_steps, 2 * len(self._noteArr))
+            self._noteArr = np.resize(self._noteArr, size)
+            self._freqArr = np.resize(self._freqArr, size)
+            self._veloArr = np.resize(self._veloArr, size)
+            self._gateArr = np.resize(self._gateArr, size)
+            self._activeArr = np.resize(self._activeArr, size)
+            self._lenArr = np.resize(self._lenArr, size)
+        if nb_steps > count:
+            self._noteArr[count:nb_steps] =0
+            self._freqArr[count:nb_steps] =0
+            self._veloArr[count:nb_steps] =1
+            self._gateArr[count:nb_steps] =1
+            self._activeArr[count:nb_steps] = True
+            self._lenArr[count:nb_steps] =0
+            self._dataLst.extend([None] * (nb_steps - count))
+            self._fileLst.extend([""] * (nb_steps - count))
+        else:
+            del self._dataLst[nb_steps:]
+            del self._fileLst[nb_steps:]
+        self._count = nb_steps
+        self._viewLst = None
+
+    #-------------------------------------------
+
+    def append(self, freq=0, note=0, data_len=0, raw_data=None, filename=""):
+        """ add step, and returns its index """
+        index = self._count
+        self.resize(index +1)
+        self._freqArr[index] = freq
+        self._noteArr[index] = note
+        self._lenArr[index] = data_len
+        self._dataLst[index] = raw_data
+        self._fileLst[index] = filename
+
+        return index
+
+    #-------------------------------------------
+
+    def copy(self):
+        """ returns a copy of the columns, sharing the read only audio buffers """
+        count = self._count
+        store = StepStore()
+        store._noteArr = self._noteArr[:count].copy()
+        store._freqArr = self._freqArr[:count].copy()
+        store._veloArr = self._veloArr[:count].copy()
+        store._gateArr = self._gateArr[:count].copy()
+        store._activeArr = self._activeArr[:count].copy()
+        store._lenArr = self._lenArr[:count].copy()
+        store._dataLst = list(self._dataLst)
+        store._fileLst = list(self._fileLst)
+        store._count = count
+
+        return store
+
+    #-------------------------------------------
+
+    def copy_step(self, index, samp):
+        """ copy the step fields of SampleObj samp at index """
+        self._freqArr[index] = samp.freq
+        self._noteArr[index] = samp.note
+        self._veloArr[index] = samp.velocity
+        self._gateArr[index] = samp.gate
+        self._activeArr[index] = samp.active
+        self._lenArr[index] = samp.data_len
+        self._dataLst[index] = samp.raw_data
+        self._fileLst[index] = samp.filename
+
+    #-------------------------------------------
+
+    def get_view(self, index):
+        """ returns SampleObj view of the step, or None """
+        if 0 <= index < self._count:
+            return self.get_views()[index]
+
+    #-------------------------------------------
+
+    def get_views(self):
+        if self._viewLst is None:
+            self._viewLst = [SampleObj(store=self, index=index) for index in range(self._count)]
+        
+        return self._viewLst
+
+    #-------------------------------------------
+
+    def set_views(self, samp_lst):
+        """ copy the steps of SampleObj list, and bind them as views """
+        self.resize(len(samp_lst))
+        for (index, samp) in enumerate(samp_lst):
+            self.copy_step(index, samp)
+            samp.bind(self, index)
+        self._viewLst = list(samp_lst)
+
+    #-------------------------------------------
+
+    # columns, as views for vectorized queries and edits
+    def get_notes(self):
+        return self._noteArr[:self._count]
+
+    #-------------------------------------------
+
+    def get_freqs(self):
+        return self._freqArr[:self._count]
+
+    #-------------------------------------------
+
+    def get_velocities(self):
+        return self._veloArr[:self._count]
+
+    #-------------------------------------------
+
+    def get_gates(self):
+        return self._gateArr[:self._count]
+
+    #-------------------------------------------
+
+    def get_actives(self):
+        return self._activeArr[:self._count]
+
+    #-------------------------------------------
+
+    def get_lens(self):
+        return self._lenArr[:self._count]
+
+    #-------------------------------------------
+
+    def get_note(self, index):
+        if 0 <= index < self._count:
+            return int(self._noteArr[index])
+        return 0
+
+    #-------------------------------------------
+
+    def get_freq(self, index):
+        if 0 <= index < self._count:
+            return float(self._freqArr[index])
+        return 0
+
+    #-------------------------------------------
+
+    def set_notes(self, index_arr, note_arr, freq_arr):
+        """ set notes and freqs at the indexes, in one array operation """
+        self._noteArr[index_arr] = note_arr
+        self._freqArr[index_arr] = freq_arr
+
+    #-------------------------------------------
+
+    def get_data(self, index):
+        return self._dataLst[index]
+
+    #-------------------------------------------
+
+    def set_data(self, index, raw_data):
+        self._dataLst[index] = raw_data
+
+    #-------------------------------------------
+
+    def get_file(self, index):
+        return self._fileLst[index]
+
+    #-------------------------------------------
+
+    def get_fileList(self):
+        return self._fileLst
+
+    #-------------------------------------------
+
+    def is_file(self, index):
+        return bool(self._fileLst[index])
+
+    #-------------------------------------------
+
+#========================================
+
+def _make_column(name, arr_name, to_type):
+    """ returns property reading and writing a step column of the store """
+    def fget(self):
+        return to_type(getattr(self._store, arr_name)[self._index])
+    def fset(self, val):
+        getattr(self._store, arr_name)[self._index] = val
+
+    return property(fget, fset, doc=f"step {name}")
+
+#------------------------------------------------------------------------------
 
 class SampleObj(object):
-    def __init__(self, freq=0, _len=0):
-        self.freq = freq
-        self.note =0
-        self.data_len = _len
-        self.raw_data = None
+    """
+    view of a step in a StepStore, kept for compatibility,
+    standalone steps have their own store
+    """
+    __slots__ = ("_store", "_index")
+    def __init__(self, freq=0, _len=0, store=None, index=0):
+        if store is None:
+            store = StepStore()
+            index = store.append(freq=freq, data_len=_len)
+        self._store = store
+        self._index = index
   
     #-------------------------------------------
 
+    freq = _make_column("freq", "_freqArr", float)
+    note = _make_column("note", "_noteArr", int)
+    velocity = _make_column("velocity", "_veloArr", float)
+    gate = _make_column("gate", "_gateArr", float)
+    active = _make_column("active", "_activeArr", bool)
+    data_len = _make_column("data_len", "_lenArr", float)
+
+    #-------------------------------------------
+
+    @property
+    def raw_data(self):
+        return self._store._dataLst[self._index]
+
+    @raw_data.setter
+    def raw_data(self, raw_data):
+        self._store._dataLst[self._index] = raw_data
+
+    #-------------------------------------------
+
+    @property
+    def filename(self):
+        return self._store._fileLst[self._index]
+
+    @filename.setter
+    def filename(self, filename):
+        self._store._fileLst[self._index] = filename
+
+    #-------------------------------------------
+
+    def bind(self, store, index):
+        """ view of the step at index in store """
+        self._store = store
+        self._index = index
+
+    #-------------------------------------------
+
+    def is_file(self):
+        return bool(self.filename)
+
+    #-------------------------------------------
+
+    def get_data(self, nb_samples):
+        """ returns nb_samples of raw data, padded with silence when the data is shorter """
+        data = self.raw_data[0:nb_samples]
+        if len(data) < nb_samples:
+            data = np.concatenate((data, np.zeros(nb_samples - len(data), dtype=data.dtype)))
+        
+        return data
+
+    #-------------------------------------------
+
 #========================================
 
 
-class BaseDriver(object):
-    def __init__(self):
-        self._rate = 48000
-        self._channels =1
-        self._frameCount =960
-        self._frameBytes = self._frameCount * 4 # in float, so 4 bytes
-   
+class SampleBank(object):
+    """
+    wav files decoded once, and shared by the steps of all patterns.
+    mono float files at the engine rate are memory mapped, with no copy
+    """
+    # (format tag, bits): samples type, 24 bits is decoded apart
+    _typeDic = {
+            (1, 8): np.dtype("u1"),
+            (1, 16): np.dtype("<i2"),
+            (1, 32): np.dtype("<i4"),
+            (3, 32): np.dtype("<f4"),
+            (3, 64): np.dtype("<f8"),
+            }
+    def __init__(self, rate=48000, dtype=np.float32):
+        self._rate = rate
+        self._dtype = np.dtype(dtype)
+        self._sampDic = {} # (path, rate): buffer
+
+    #-------------------------------------------
+
+    def set_rate(self, rate):
+        self._rate = rate
+
+    #-------------------------------------------
+
+    def read_header(self, filename):
+        """ returns (format tag, channels, rate, bits, data offset, data length) """
+        fmt = None
+        with open(filename, "rb") as f:
+            (riff, _, wave) = struct.unpack("<4sI4s", f.read(12))
+            if riff != b"RIFF" or wave != b"WAVE":
+                raise ValueError(f"Not a wav file: {filename}")
+            while 1:
+                chunk = f.read(8)
+                if len(chunk) < 8:
+                    raise ValueError(f"No data chunk in wav file: {filename}")
+                (chunk_id, size) = struct.unpack("<4sI", chunk)
+                if chunk_id == b"fmt ":
+                    buf = f.read(size)
+                    (tag, channels, rate, _, _, bits) = struct.unpack("<HHIIHH", buf[0:16])
+                    if tag == 0xFFFE: # extensible format, the tag in the sub format
+                        tag = struct.unpack("<H", buf[24:26])[0]
+                    fmt = (tag, channels, rate, bits)
+                elif chunk_id == b"data":
+                    if fmt is None:
+                        raise ValueError(f"No fmt chunk in wav file: {filename}")
+                    return fmt + (f.tell(), size)
+                else:
+                    # chunks are word aligned
+                    f.seek(size + (size & 1), 1)
+
+    #-------------------------------------------
+
+    def decode(self, filename):
+        """ returns mono buffer at the engine rate, memory mapped when possible """
+        (tag, channels, rate, bits, offset, size) = self.read_header(filename)
+        frame_bytes = channels * bits // 8
+        nb_frames = size // frame_bytes
+        if (tag, bits) == (1, 24):
+            raw = np.memmap(filename, dtype=np.uint8, mode="r", offset=offset, shape=(nb_frames * frame_bytes,))
+            raw = raw.reshape(-1, 3).astype(np.int32)
+            arr = (raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)) << 8 # sign extended by the shift
+            arr = arr.reshape(nb_frames, channels)
+            samp_type = np.dtype("<i4")
+        else:
+            samp_type = self._typeDic.get((tag, bits))
+            if samp_type is None:
+                raise ValueError(f"Wav format not supported: tag {tag}, {bits} bits")
+            arr = np.memmap(filename, dtype=samp_type, mode="r", offset=offset, shape=(nb_frames, channels))
+        if channels == 1 and rate == self._rate and arr.dtype == self._dtype:
+            # zero copy
+            return arr.reshape(-1)
+        if samp_type.kind == "f":
+            data = arr.mean(axis=1, dtype=np.float64)
+        elif samp_type.kind == "u":
+            data = (arr.mean(axis=1, dtype=np.float64) - 128) / 128
+        else:
+            data = arr.mean(axis=1, dtype=np.float64) / 2**(8 * samp_type.itemsize -1)
+        if rate != self._rate and nb_frames:
+            # linear resampling
+            nb_out = int(round(nb_frames * self._rate / rate))
+            data = np.interp(np.arange(nb_out) * (rate / self._rate), np.arange(nb_frames), data)
+        data = data.astype(self._dtype)
+        data.flags.writeable = False
+
+        return data
+
+    #-------------------------------------------
+
+    def get_sample(self, filename):
+        """ returns the read only buffer of the wav file, decoded at the first call """
+        key = (os.path.realpath(filename), self._rate)
+        buf = self._sampDic.get(key)
+        if buf is None:
+            buf = self._sampDic[key] = self.decode(filename)
+        
+        return buf
+
+    #-------------------------------------------
+
+    def clear(self):
+        self._sampDic.clear()
+
+    #-------------------------------------------
+
+    def get_info(self):
+        """ returns dict of files count, mapped files count, and decoded bytes in memory """
+        mapped_lst = [isinstance(buf, np.memmap) for buf in self._sampDic.values()]
+        nb_bytes = sum(buf.nbytes for (buf, mapped) in zip(self._sampDic.values(), mapped_lst) if not mapped)
+        return {
+                "files": len(self._sampDic),
+                "mapped": sum(mapped_lst),
+                "bytes": nb_bytes,
+                }
+
+    #-------------------------------------------
+
+#========================================
+
+def get_pyaudio():
+    """ returns the PyAudio instance, initializing it at first call """
+    global _pa
+    if _pa is None:
+        import pyaudio
+        _pa = pyaudio.PyAudio()
+    
+    return _pa
+
+#------------------------------------------------------------------------------
+
+class BaseDriver(object):
+    """ Audio Driver interface """
+    _minFrameCount = 64
+    _maxFrameCount = 4096
+
+    def __init__(self, rate=48000, frame_count=960):
+        self._channels =1
+        self.set_format(rate, frame_count)
+   
+    #-------------------------------------------
+
+    def set_format(self, rate, frame_count):
+        """ sample rate and block size, in frames """
+        self._rate = rate
+        self._frameCount = frame_count
+        self._frameBytes = self._frameCount * 4 # in float, so 4 bytes
+
+    #-------------------------------------------
+
+    def get_rate(self):
+        return self._rate
+
+    #-------------------------------------------
+
+    def get_frameCount(self):
+        return self._frameCount
+
+    #-------------------------------------------
+
+    def get_latency(self):
+        """ returns output latency in secs """
+        return self._frameCount / self._rate
+
+    #-------------------------------------------
+
+    def is_opened(self):
+        return False
+
+    #-------------------------------------------
+
+    def close_stream(self):
+        pass
+
+    #-------------------------------------------
+
+    def set_streamCallback(self, func):
+        """ func(in_data, frame_count, time_info, status) -> (data, flag) """
+        self._func_callback = func
+
+    #-------------------------------------------
+
+    def open_stream(self):
+        pass
+
+    #-------------------------------------------
+   
+    def init_driver(self):
+        self.open_stream()
+
+    #-------------------------------------------
+
+    def write(self, samp):
+        pass
+
+    #-------------------------------------------
+
+    def start(self):
+        pass
+
+    #-------------------------------------------
+
+    def stop(self):
+        pass
+
+    #-------------------------------------------
+
+    def close(self):
+        pass
+
+    #-------------------------------------------
+
+#========================================
+
+class PortDriver(BaseDriver):
+    """ Port Audio Driver """
+    def __init__(self):
+        super().__init__()
+        self._stream = None
+        self._func_callback = None
+
+    #-------------------------------------------
+
+    def open_stream(self):
+        import pyaudio
+        self._stream = get_pyaudio().open(
+                    rate = self._rate,
+                    channels = self._channels,
+                    # format=pyaudio.paInt16,
+                    format = pyaudio.paFloat32,
+                    output=True,
+                    frames_per_buffer = self._frameCount, # 960
+                    start = False, # starting the callback function 
+                    stream_callback = self._func_callback
+                    )
+
+    #-------------------------------------------
+   
+    def init_driver(self):
+        self.open_stream()
+
+    #-------------------------------------------
+
+    def write(self, samp):
+        assert self._stream
+        self._stream.write(samp)
+
+    #-------------------------------------------
+
+    def start(self):
+        if not self._stream: return
+        self._stream.start_stream()
+       
+    #-------------------------------------------
+
+    def stop(self):
+        if not self._stream: return
+        self._stream.stop_stream()
+       
+    #-------------------------------------------
+
+    def is_opened(self):
+        return self._stream is not None
+
+    #-------------------------------------------
+
+    def get_latency(self):
+        """ returns the output latency reported by the stream, in secs """
+        if not self._stream:
+            return super().get_latency()
+        return self._stream.get_output_latency()
+
+    #-------------------------------------------
+
+    def close_stream(self):
+        if self._stream:
+            self._stream.close()
+            self._stream = None
+
+    #-------------------------------------------
+    
+    def close(self):
+        global _pa
+        self.close_stream()
+        if _pa is not None:
+            _pa.terminate()
+            _pa = None
+
+    #-------------------------------------------
+    
+#========================================
+
+class NullDriver(BaseDriver):
+    """
+    Null Driver, without sound card.
+    Pulls the stream callback from a thread on a simulated clock,
+    at full speed or paced to realtime
+    """
+    def __init__(self, realtime=False):
+        super().__init__()
+        self._func_callback = None
+        self._realtime = realtime
+        self._thread = None
+        self._running = False
+        self._opened = False
+        self._frameTime =0 # simulated clock, in frames
+        self._nbCycles =0
+
+    #-------------------------------------------
+
+    def open_stream(self):
+        self._opened = True
+
+    #-------------------------------------------
+
+    def is_opened(self):
+        return self._opened
+
+    #-------------------------------------------
+
+    def close_stream(self):
+        self.stop()
+        self._opened = False
+
+    #-------------------------------------------
+
+    def get_time(self):
+        """ returns the simulated clock in secs """
+        return self._frameTime / self._rate
+
+    #-------------------------------------------
+
+    def write(self, samp):
+        self.process_data(samp)
+
+    #-------------------------------------------
+
+    def process_data(self, data):
+        """ output of the callback, discarded by the null driver """
+        pass
+
+    #-------------------------------------------
+
+    def run_cycle(self):
+        """ pulls one buffer from the callback, returns the callback flag """
+        assert self._func_callback
+        cur_time = self.get_time()
+        time_info = {
+                "input_buffer_adc_time": 0,
+                "current_time": cur_time,
+                "output_buffer_dac_time": cur_time,
+                }
+        (data, flag) = self._func_callback(None, self._frameCount, time_info, 0)
+        if data is not None:
+            self.process_data(data)
+        self._frameTime += self._frameCount
+        self._nbCycles +=1
+        
+        return flag
+
+    #-------------------------------------------
+
+    def run(self, nb_cycles):
+        """ pulls synchronously nb_cycles buffers, returns number of cycles done """
+        for i in range(nb_cycles):
+            if self.run_cycle() != _paContinue:
+                return i +1
+        
+        return nb_cycles
+
+    #-------------------------------------------
+
+    def _run_thread(self):
+        start_time = time.perf_counter()
+        start_frame = self._frameTime
+        while self._running:
+            if self.run_cycle() != _paContinue:
+                self._running = False
+                break
+            if self._realtime:
+                delay = start_time + (self._frameTime - start_frame) / self._rate - time.perf_counter()
+                if delay > 0: time.sleep(delay)
+            else:
+                # let other threads run
+                time.sleep(0)
+
+    #-------------------------------------------
+
+    def start(self):
+        if not self._opened or self._running: return
+        self._running = True
+        self._thread = threading.Thread(target=self._run_thread, daemon=True)
+        self._thread.start()
+
+    #-------------------------------------------
+
+    def stop(self):
+        self._running = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    #-------------------------------------------
+
+    def close(self):
+        self.close_stream()
+
+    #-------------------------------------------
+
+#========================================
+
+class FileDriver(NullDriver):
+    """ File Driver, streams the callback output to a wav file """
+    def __init__(self, filename="/tmp/stepyseq_out.wav", realtime=False):
+        super().__init__(realtime)
+        self._filename = filename
+        self._writer = None
+
+    #-------------------------------------------
+
+    def open_stream(self):
+        # the same file, when the stream is reopened with a new block size
+        if self._writer is None:
+            self._writer = WavWriter(self._filename, self._rate, self._channels)
+            self._writer.open()
+        super().open_stream()
+
+    #-------------------------------------------
+
+    def process_data(self, data):
+        if self._writer:
+            self._writer.write(data)
+
+    #-------------------------------------------
+
+    def close(self):
+        super().close()
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+    #-------------------------------------------
+
+#========================================
+
+_driverDic = {
+        "port": PortDriver,
+        "null": NullDriver,
+        "file": FileDriver,
+        }
+
+def make_driver(name="port", **kwargs):
+    """ returns new audio driver by name """
+    try:
+        return _driverDic[name](**kwargs)
+    except KeyError:
+        raise ValueError(f"Unknown audio driver: {name}")
+
+#------------------------------------------------------------------------------
+
+class WaveGenerator(object):
+    """ generate waveform """
+    def __init__(self, rate=44100, channels=1, _len=1, cache_size=128*1024*1024, dtype=np.float32):
+        self._rate = rate
+        self._channels = channels
+        self._len = _len
+        self._dtype = np.dtype(dtype) # samples type
+        self._waveform = "sine"
+        self._waveDic = {
+                "sine": self.gen_sine,
+                "square": self.gen_square,
+                "saw": self.gen_saw,
+                "triangle": self.gen_triangle,
+                }
+        # LRU cache of shared read only buffers, under a budget in bytes
+        self._cacheDic = OrderedDict()
+        self._cacheSize = cache_size
+        self._cacheBytes =0
+        self._cacheHits =0
+        self._cacheMisses =0
+
+    #-------------------------------------------
+
+    def get_waveform(self):
+        return self._waveform
+
+    #-------------------------------------------
+
+    def set_waveform(self, waveform):
+        if waveform in self._waveDic:
+            self._waveform = waveform
+
+    #-------------------------------------------
+
+    def get_phase(self, freq, nb_samples):
+        """ returns the phase in cycles, between 0 and 1 """
+        x = np.arange(nb_samples)
+        return (freq * x / self._rate) % 1.0
+
+    #-------------------------------------------
+
+    def get_dtype(self):
+        return self._dtype
+
+    #-------------------------------------------
+
+    def gen_fromPhase(self, phase, waveform="", out=None):
+        """
+        returns samples from phase array in cycles, for streaming oscillators
+        phase is modified in place, result in out if given
+        """
+        if not waveform:
+            waveform = self._waveform
+        if waveform == "sine":
+            np.multiply(phase, _TWO_PI, out=phase)
+            if out is None:
+                out = np.empty(len(phase), dtype=self._dtype)
+            # in phase first, the cast to out would use a temporary buffer
+            np.sin(phase, out=phase)
+            np.copyto(out, phase)
+            return out
+        
+        phase %= 1.0
+        # in place in phase, without temporary arrays
+        if waveform == "square":
+            # 1 for the first half cycle, -1 for the second one
+            phase *= 2.0
+            np.floor(phase, out=phase)
+            phase *= -2.0
+            phase += 1.0
+        elif waveform == "saw":
+            phase *= 2.0
+            phase -= 1.0
+        else: # triangle
+            phase -= 0.5
+            np.abs(phase, out=phase)
+            phase *= -4.0
+            phase += 1.0
+        if out is None:
+            return phase.astype(self._dtype)
+        np.copyto(out, phase)
+        
+        return out
+
+    #-------------------------------------------
+
+    def gen_sine(self, freq, nb_samples):
+        x = np.arange(nb_samples)
+        # the math function, is also the final sample
+        # phase computed in float64 for precision, samples in the generator dtype
+        arr = 2 * np.pi * freq * x / self._rate
+        np.sin(arr, out=arr)
+        return arr.astype(self._dtype, copy=False)
+
+    #-------------------------------------------
+
+    def gen_square(self, freq, nb_samples):
+        phase = self.get_phase(freq, nb_samples)
+        return np.where(phase < 0.5, 1.0, -1.0).astype(self._dtype, copy=False)
+
+    #-------------------------------------------
+
+    def gen_saw(self, freq, nb_samples):
+        phase = self.get_phase(freq, nb_samples)
+        return (2.0 * phase - 1.0).astype(self._dtype, copy=False)
+
+    #-------------------------------------------
+
+    def gen_triangle(self, freq, nb_samples):
+        phase = self.get_phase(freq, nb_samples)
+        return (1.0 - 4.0 * np.abs(phase - 0.5)).astype(self._dtype, copy=False)
+
+    #-------------------------------------------
+
+    def gen_samples(self, freq=440, _len=0, waveform=""):
+        """
+        returns a read only buffer, shared with the other callers
+        for the same waveform, freq, length and rate
+        """
+        if _len == 0:
+            _len = self._len
+        if not waveform:
+            waveform = self._waveform
+        nb_samples = int(_len * self._rate)
+        key = (waveform, float(freq), nb_samples, self._rate)
+        arr = self._cacheDic.get(key)
+        if arr is not None:
+            self._cacheHits +=1
+            self._cacheDic.move_to_end(key)
+            return arr
+
+        self._cacheMisses +=1
+        arr = self._waveDic[waveform](freq, nb_samples)
+        arr.flags.writeable = False
+        self.add_cache(key, arr)
+        
+        return arr
+
+    #-------------------------------------------
+
+    def gen_multi(self, freq_lst, _len=0, waveform=""):
+        """
+        returns list of shared read only buffers for freq_lst,
+        synthesizing the missing ones in one 2D pass
+        """
+        if _len == 0:
+            _len = self._len
+        if not waveform:
+            waveform = self._waveform
+        nb_samples = int(_len * self._rate)
+        key_lst = [(waveform, float(freq), nb_samples, self._rate) for freq in freq_lst]
+        missing_lst = []
+        for key in key_lst:
+            if key not in self._cacheDic and key not in missing_lst:
+                missing_lst.append(key)
+        if missing_lst:
+            self._cacheMisses += len(missing_lst)
+            freq_arr = np.array([key[1] for key in missing_lst])
+            # one row by frequency, broadcasting freqs against sample indexes
+            arr2d = self._waveDic[waveform](freq_arr[:, np.newaxis], nb_samples)
+            # own buffer by row, a view would keep the whole block alive in the cache
+            buf_dic = {}
+            for (key, row) in zip(missing_lst, arr2d):
+                arr = row.copy()
+                arr.flags.writeable = False
+                buf_dic[key] = arr
+        else:
+            buf_dic = {}
+        buf_lst = []
+        for key in key_lst:
+            arr = buf_dic.get(key)
+            if arr is None:
+                arr = self.gen_samples(key[1], _len, waveform)
+            buf_lst.append(arr)
+        for (key, arr) in buf_dic.items():
+            self.add_cache(key, arr)
+        
+        return buf_lst
+
+    #-------------------------------------------
+
+    def add_cache(self, key, arr):
+        """ add buffer to the cache, evicting the least recently used ones """
+        if arr.nbytes > self._cacheSize: return
+        self._cacheDic[key] = arr
+        self._cacheBytes += arr.nbytes
+        while self._cacheBytes > self._cacheSize:
+            (_, old_arr) = self._cacheDic.popitem(last=False)
+            self._cacheBytes -= old_arr.nbytes
+
+    #-------------------------------------------
+
+    def set_cacheSize(self, nb_bytes):
+        """ set the cache budget in bytes, 0 for disabling the cache """
+        self._cacheSize = max(0, nb_bytes)
+        while self._cacheDic and self._cacheBytes > self._cacheSize:
+            (_, old_arr) = self._cacheDic.popitem(last=False)
+            self._cacheBytes -= old_arr.nbytes
+
+    #-------------------------------------------
+
+    def clear_cache(self):
+        self._cacheDic.clear()
+        self._cacheBytes =0
+
+    #-------------------------------------------
+
+    def get_cacheInfo(self):
+        return {
+                "hits": self._cacheHits,
+                "misses": self._cacheMisses,
+                "entries": len(self._cacheDic),
+                "bytes": self._cacheBytes,
+                "size": self._cacheSize,
+                }
+
+    #-------------------------------------------
+
+#========================================
+
+class StreamOsc(object):
+    """
+    Streaming oscillator, one by voice
+    generates blocks on demand from a phase accumulator
+    """
+    def __init__(self, wave_gen, frame_count=960):
+        self._waveGen = wave_gen
+        self._rate = wave_gen._rate
+        self._frameCount = frame_count
+        self._ramp = np.arange(frame_count, dtype='float64')
+        self._phaseBuf = np.zeros(frame_count, dtype='float64')
+        self._buf = np.zeros(frame_count, dtype=wave_gen.get_dtype())
+        self._phase = 0.0 # in cycles
+        # 0-d arrays, a float operand would be converted by block
+        self._incArr = np.zeros(())
+        self._phaseArr = np.zeros(())
+
+    #-------------------------------------------
+
+    def reset(self):
+        self._phase = 0.0
+
+    #-------------------------------------------
+
+    def gen_block(self, freq, nb_frames=0, out=None):
+        """
+        returns the next nb_frames samples at freq, in out if given,
+        else in the oscillator buffer, valid until the next call
+        """
+        if nb_frames == 0 or nb_frames > self._frameCount:
+            nb_frames = self._frameCount
+        if nb_frames == self._frameCount:
+            (ramp, phase) = (self._ramp, self._phaseBuf)
+            if out is None: out = self._buf
+        else:
+            (ramp, phase) = (self._ramp[0:nb_frames], self._phaseBuf[0:nb_frames])
+            if out is None: out = self._buf[0:nb_frames]
+        inc = freq / self._rate # in cycles by sample
+        self._incArr[()] = inc
+        self._phaseArr[()] = self._phase
+        np.multiply(ramp, self._incArr, out=phase)
+        np.add(phase, self._phaseArr, out=phase)
+        # keep the accumulator small, for precision
+        self._phase = (self._phase + inc * nb_frames) % 1.0
+        
+        return self._waveGen.gen_fromPhase(phase, out=out)
+
+    #-------------------------------------------
+
+#========================================
+
+class StreamFrames(object):
+    """
+    Frames of a step, generated on demand by the pattern oscillator,
+    used like the frames array of a prerendered step
+    """
+    def __init__(self, osc, samp, nb_frames):
+        self._osc = osc
+        self._samp = samp
+        self._nbFrames = nb_frames
+
+    #-------------------------------------------
+
+    def __len__(self):
+        return self._nbFrames
+
+    #-------------------------------------------
+
+    def __getitem__(self, index):
+        if index < 0 or index >= self._nbFrames:
+            raise IndexError("frame index out of range")
+        if index == 0:
+            # new note
+            self._osc.reset()
+        
+        return self._osc.gen_block(self._samp.freq)
+
+    #-------------------------------------------
+
+#========================================
+
+class Track(object):
+    """ steps of a pattern track, with gain, mute and solo """
+    def __init__(self, name="", gain=1.0):
+        self._name = name
+        self._gain = gain
+        self._muted = False
+        self._solo = False
+        self._steps = StepStore()
+        self._frameLst = []
+        self._frameCount =0 # block size of the frames
+        self._byteLst = []
+        self._dirtySet = set() # indexes of steps to update
+        self._pubSet = set() # indexes of steps changed since the last snapshot
+        self._pubAll = True # whole track to copy in the next snapshot
+        self._baseTrack = None # previous snapshot, whose frames are reused by update_frames
+        self._osc = None # streaming oscillator, no prerendered audio
+    
+    #-------------------------------------------
+
+    def get_name(self):
+        return self._name
+
+    #-------------------------------------------
+
+    def get_gain(self):
+        return self._gain
+
+    #-------------------------------------------
+
+    def set_gain(self, gain):
+        if gain >= 0 and gain <= 1:
+            self._gain = gain
+
+    #-------------------------------------------
+
+    def is_muted(self):
+        return self._muted
+
+    #-------------------------------------------
+
+    def set_muted(self, muted):
+        self._muted = muted
+
+    #-------------------------------------------
+
+    def is_solo(self):
+        return self._solo
+
+    #-------------------------------------------
+
+    def set_solo(self, solo):
+        self._solo = solo
+
+    #-------------------------------------------
+
+    def set_streamOsc(self, osc):
+        """ set streaming oscillator, or None for prerendered steps """
+        self._osc = osc
+
+    #-------------------------------------------
+
+    def is_streaming(self):
+        return self._osc is not None
+
+    #-------------------------------------------
+
+    def copy(self):
+        """ returns a copy of the track and its steps, sharing the oscillator """
+        track = Track(self._name, self._gain)
+        track._muted = self._muted
+        track._solo = self._solo
+        track.set_steps(self._steps.copy())
+        track.set_streamOsc(self._osc)
+
+        return track
+
+    #-------------------------------------------
+
+    def make_snapshot(self, base=None, keep_frames=True):
+        """
+        returns snapshot of the track to play, after base, its previous snapshot:
+        base itself when unchanged, else a copy rebuilding the frames of the changed steps only,
+        the others taken from base when keep_frames. The changes are cleared
+        """
+        if base is None or self._pubAll or len(base._steps) != len(self._steps):
+            track = self.copy()
+        elif (not self._pubSet and (self._gain, self._muted, self._solo, self._osc)
+                == (base._gain, base._muted, base._solo, base._osc)):
+            return base
+        else:
+            track = Track(self._name, self._gain)
+            track._muted = self._muted
+            track._solo = self._solo
+            # the snapshot steps are read only, shared when not changed
+            track.set_steps(self._steps.copy() if self._pubSet else base._steps)
+            track.set_streamOsc(self._osc)
+            if keep_frames:
+                track._baseTrack = base
+                track._dirtySet = self._pubSet
+        self._pubSet = set()
+        self._pubAll = False
+
+        return track
+
+    #-------------------------------------------
+
+    def set_changed(self):
+        """ mark all the steps changed, for the next snapshot """
+        self._pubAll = True
+
+    #-------------------------------------------
+ 
+    def get_freq(self, index):
+        return self._steps.get_freq(index)
+    
+    #-------------------------------------------
+
+    def set_freq(self, index, freq):
+        if freq >= 0 and freq <= 20000 and 0 <= index < len(self._steps):
+            self._steps.get_freqs()[index] = freq
+    
+    #-------------------------------------------
+
+    def get_note(self, index):
+        return self._steps.get_note(index)
+    
+    #-------------------------------------------
+
+    def set_note(self, index, note):
+        if note >= 0 and note <= 127 and 0 <= index < len(self._steps):
+            self._steps.get_notes()[index] = note
+    
+    #-------------------------------------------
+
+    def set_notes(self, note_dic, freq_func):
+        """
+        set notes and freqs from a dict of step index: note,
+        freq_func converting an array of notes.
+        marking the steps dirty. returns list of changed indexes
+        """
+        index_arr = np.fromiter(note_dic.keys(), dtype=np.int64, count=len(note_dic))
+        note_arr = np.fromiter(note_dic.values(), dtype=np.int64, count=len(note_dic))
+        
+        return self.set_noteArray(index_arr, note_arr, freq_func)
+
+    #-------------------------------------------
+
+    def set_noteArray(self, index_arr, note_arr, freq_func):
+        """
+        set notes at indexes, in array operations, skipping out of range ones,
+        marking the steps dirty. returns list of changed indexes
+        """
+        mask = (index_arr >= 0) & (index_arr < len(self._steps)) & (note_arr >= 0) & (note_arr <= 127)
+        index_arr = index_arr[mask]
+        note_arr = note_arr[mask]
+        if not len(index_arr): return []
+        self._steps.set_notes(index_arr, note_arr, freq_func(note_arr))
+        index_lst = index_arr.tolist()
+        self._dirtySet.update(index_lst)
+        self._pubSet.update(index_lst)
+        
+        return index_lst
+
+    #-------------------------------------------
+
+    def get_steps(self):
+        return self._steps
+
+    #-------------------------------------------
+
+    def set_steps(self, steps):
+        """ init the steps store """
+        self._steps = steps
+        self._frameLst = []
+        self._dirtySet.clear()
+        self._pubAll = True
+        self._baseTrack = None
+
+    #-------------------------------------------
+   
+    def set_sample(self, index, samp):
+        """ copy the step fields of samp at index """
+        if 0 <= index < len(self._steps):
+            self._steps.copy_step(index, samp)
+            self.set_dirty(index)
+ 
+    #-------------------------------------------
+
+    def get_sample(self, index):
+        """ returns SampleObj view of the step, or None """
+        return self._steps.get_view(index)
+ 
+    #-------------------------------------------
+      
+    def set_sampleList(self, samp_lst):
+        """ init steps from SampleObj list, bound as views of the store """
+        steps = StepStore()
+        steps.set_views(samp_lst)
+        self.set_steps(steps)
+
+    #-------------------------------------------
+
+    def get_sampleList(self):
+        return self._steps.get_views()
+
+    #-------------------------------------------
+
+    def set_frameList(self, nb_samples, frame_count):
+        # generate array of frames by reshaping
+        self._frameLst = []
+        self._frameCount = frame_count
+        self._baseTrack = None
+        # reshape accept only a multiple of frame_count
+        (quo, rest) = divmod(nb_samples, frame_count)
+        if rest: nb_samples -= rest
+        for samp in self._steps.get_views():
+            self._frameLst.append(self.make_frames(samp, nb_samples, frame_count))
+            # TODO: adding rest samples
+        self._dirtySet.clear()
+   
+    #-------------------------------------------
+
+    def make_frames(self, samp, nb_samples, frame_count):
+        """ returns frames of a step, nb_samples being a multiple of frame_count """
+        if self._osc and not samp.is_file():
+            return StreamFrames(self._osc, samp, nb_samples // frame_count)
+        # no copy, just numpy view slicing, except for short samples
+        # the views of the blocks created once, for read_step
+        return list(samp.get_data(nb_samples).reshape(-1, frame_count))
+
+    #-------------------------------------------
+
+    def get_frameList(self):
+        return self._frameLst
+
+    #-------------------------------------------
+
+    def get_frame(self, samp_index, frame_index):
+        """ returns frame of a step, or None when the step has no such frame """
+        try:
+            return self._frameLst[samp_index][frame_index]
+        except IndexError:
+            return
+
+    #-------------------------------------------
+
+    def get_blockFrame(self, index, offset, nb_frames):
+        """ returns the frame of nb_frames at offset in the step, if built, or None """
+        frame_lst = self._frameLst
+        if nb_frames != self._frameCount or index >= len(frame_lst) or offset % nb_frames: return
+        row_lst = frame_lst[index]
+        frame_index = offset // nb_frames
+        if frame_index >= len(row_lst): return
+
+        return row_lst[frame_index]
+
+    #-------------------------------------------
+
+    def read_step(self, index, offset, out, env=None, step_len=0):
+        """
+        copy step audio from offset to out, zero padding after the step data,
+        silence for inactive steps, gated by the curve of env
+        """
+        # hot path, reading the store columns directly
+        # without views for the blocks aligned on the frames
+        steps = self._steps
+        if index < 0 or index >= steps._count or not steps._activeArr.item(index):
+            out.fill(0)
+            return
+        nb_frames = len(out)
+        gate = None
+        if env is not None:
+            gate = env.get_curve(step_len, steps._gateArr.item(index))
+            if gate is not None and offset >= gate[3]:
+                # after the release, no audio to read
+                out.fill(0)
+                return
+        if self._osc and not steps._fileLst[index]:
+            if offset == 0:
+                # new note
+                self._osc.reset()
+            self._osc.gen_block(steps._freqArr.item(index), nb_frames, out)
+        else:
+            frame = self.get_blockFrame(index, offset, nb_frames)
+            if frame is not None:
+                np.copyto(out, frame)
+            else:
+                data = steps._dataLst[index][offset:offset+nb_frames]
+                nb = len(data)
+                out[0:nb] = data
+                if nb < nb_frames:
+                    out[nb:] =0
+        velo = steps._veloArr.item(index)
+        if velo != 1:
+            out *= velo
+        if gate is not None:
+            (frame_index, rest) = divmod(offset, nb_frames)
+            block_lst = gate[4]
+            if not rest and nb_frames == env._frameCount and frame_index < len(block_lst):
+                # None in the region at 1
+                block = block_lst[frame_index]
+                if block is not None:
+                    out *= block
+            elif not (gate[1] <= offset and offset + nb_frames <= gate[2]):
+                out *= gate[0][offset:offset+nb_frames]
+
+    #-------------------------------------------
+
+    def gen_byteList(self, nb_samples, frame_count):
+        self._byteLst = []
+        # reshape accept only a multiple of frame_count
+        (quo, rest) = divmod(nb_samples, frame_count)
+        if rest: nb_samples -= rest
+        for samp in self._steps.get_views():
+            # no copy, just numpy view slicing
+            row_lst = samp.get_data(nb_samples).reshape(-1, frame_count)
+            byte_lst = [arr.astype(np.float32, copy=False).tobytes() for arr in row_lst]
+            self._byteLst.append(byte_lst)
+        
+        return self._byteLst
+
+    #-------------------------------------------
+
+    def get_byteList(self):
+        return self._byteLst
+
+    #-------------------------------------------
+
+    def set_dirty(self, index):
+        """ mark step at index, to be updated by update_frames """
+        if index >= 0 and index < len(self._steps):
+            self._dirtySet.add(index)
+            self._pubSet.add(index)
+
+    #-------------------------------------------
+
+    def is_dirty(self):
+        return len(self._dirtySet) > 0
+
+    #-------------------------------------------
+
+    def update_frames(self, nb_samples, frame_count, audio_arr=None):
+        """ 
+        update frames for dirty steps only,
+        returns list of updated indexes
+        """
+        base = self._baseTrack
+        if base is not None:
+            # frames of the previous snapshot, for the unchanged steps
+            self._baseTrack = None
+            self._frameLst = list(base._frameLst)
+            self._frameCount = base._frameCount
+            self._byteLst = list(base._byteLst)
+        if len(self._frameLst) != len(self._steps) or frame_count != self._frameCount:
+            self.set_frameList(nb_samples, frame_count)
+            return list(range(len(self._steps)))
+        nb_frames = nb_samples - (nb_samples % frame_count)
+        index_lst = sorted(self._dirtySet)
+        for index in index_lst:
+            # streaming frames read the step freq when playing
+            # view of the step only, not building the views of the whole store
+            samp = SampleObj(store=self._steps, index=index)
+            self._frameLst[index] = self.make_frames(samp, nb_frames, frame_count)
+            if self._byteLst:
+                row_lst = self._frameLst[index]
+                self._byteLst[index] = [arr.astype(np.float32, copy=False).tobytes() for arr in row_lst]
+        self._dirtySet.clear()
+        
+        return index_lst
+
+    #-------------------------------------------
+
+#========================================
+
+class EnvelopeTable(object):
+    """
+    gain curves of the steps, by step length and gate, for the quantize length
+    and the ADSR envelope, computed once and applied by one multiply
+    """
+    def __init__(self, rate=48000, dtype=np.float32, cache_size=16*1024*1024, frame_count=960):
+        self._rate = rate
+        self._dtype = np.dtype(dtype)
+        self._frameCount = frame_count
+        self._quantLen =0
+        # attack, decay, release in secs, sustain level
+        # short release, not to click at the gate end
+        self._envelope = (0.0, 0.0, 1.0, 0.005)
+        self._isFlat = True # no curve for full gates
+        self._curveDic = {} # (step_len, gate): curve and its regions
+        self._cacheSize = cache_size
+        self._cacheBytes =0
+        self._lock = threading.Lock()
+
+    #-------------------------------------------
+
+    def set_rate(self, rate):
+        self._rate = rate
+        self.clear()
+
+    #-------------------------------------------
+
+    def set_frameCount(self, frame_count):
+        """ block size of the views of the curves """
+        self._frameCount = frame_count
+        self.clear()
+
+    #-------------------------------------------
+
+    def get_params(self):
+        """ returns (quant_len, envelope), changing the curves """
+        return (self._quantLen, self._envelope)
+
+    #-------------------------------------------
+
+    def set_quantizeLen(self, quant_len):
+        """ gate length of the steps, as fraction 1/quant_len of the step """
+        self._quantLen = quant_len
+        self.update_flat()
+
+    #-------------------------------------------
+
+    def get_envelope(self):
+        return self._envelope
+
+    #-------------------------------------------
+
+    def set_envelope(self, attack=0.0, decay=0.0, sustain=1.0, release=0.005):
+        """ ADSR envelope, times in secs """
+        self._envelope = (max(0.0, float(attack)), max(0.0, float(decay)), 
+                limit_value(float(sustain), 0.0, 1.0), max(0.0, float(release)))
+        self.update_flat()
+
+    #-------------------------------------------
+
+    def update_flat(self):
+        """ curves computed again for the new parameters """
+        (attack, decay, sustain, _) = self._envelope
+        self._isFlat = (self._quantLen <= 1 and attack == 0 and (decay == 0 or sustain == 1))
+        self.clear()
+
+    #-------------------------------------------
+
+    def get_curve(self, step_len, gate):
+        """
+        returns (curve, one_start, one_end, zero_start, block_lst) for step_len samples and the step gate,
+        the curve being 1 from one_start to one_end, and 0 from zero_start,
+        with the views of its blocks, None for the blocks at 1, or None when flat
+        """
+        if gate >= 1 and self._isFlat: return
+        # read without lock, the dict is replaced when evicting
+        item = self._curveDic.get((step_len, gate))
+        if item is None:
+            item = self.add_curve(step_len, gate)
+        
+        return item
+
+    #-------------------------------------------
+
+    def add_curve(self, step_len, gate):
+        item = self.make_curve(step_len, gate)
+        nb_bytes = item[0].nbytes
+        with self._lock:
+            curve_dic = self._curveDic
+            if self._cacheBytes + nb_bytes > self._cacheSize:
+                curve_dic = {}
+                self._cacheBytes =0
+            else:
+                curve_dic = dict(curve_dic)
+            curve_dic[(step_len, gate)] = item
+            self._cacheBytes += nb_bytes
+            self._curveDic = curve_dic
+        
+        return item
+
+    #-------------------------------------------
+
+    def make_curve(self, step_len, gate):
+        """ returns the gain curve and its regions: attack, decay, sustain until the gate end, then release """
+        rate = self._rate
+        (attack, decay, sustain, release) = self._envelope
+        (att_len, dec_len, rel_len) = (round(attack * rate), round(decay * rate), round(release * rate))
+        gate_len = int(step_len * min(gate, 1) / max(self._quantLen, 1))
+        pos_arr = np.arange(step_len, dtype=np.float64)
+        # attack and decay, sustain level after them
+        xp_lst = [0, att_len, att_len + dec_len]
+        fp_lst = [0.0 if att_len else 1.0, 1.0, sustain if dec_len else 1.0]
+        curve = np.interp(pos_arr, xp_lst, fp_lst, right=sustain)
+        zero_start = step_len
+        if gate_len < step_len:
+            if rel_len:
+                curve *= np.interp(pos_arr, [gate_len, gate_len + rel_len], [1.0, 0.0])
+            else:
+                curve[gate_len:] =0
+            zero_start = gate_len + rel_len
+        (one_start, one_end) = (att_len, gate_len) if sustain == 1 else (0, 0)
+        curve = curve.astype(self._dtype)
+        curve.flags.writeable = False
+        one_end = max(one_start, one_end)
+        frame_count = self._frameCount
+        block_lst = [None if one_start <= pos and pos + frame_count <= one_end else curve[pos:pos+frame_count]
+                for pos in range(0, step_len - frame_count +1, frame_count)]
+        
+        return (curve, one_start, one_end, zero_start, block_lst)
+
+    #-------------------------------------------
+
+    def prepare(self, step_len, gate_lst):
+        """ compute the curves of the gates for a fractional step length, before playing them """
+        for gate in set(gate_lst):
+            for nb in (math.floor(step_len), math.ceil(step_len)):
+                self.get_curve(nb, gate)
+
+    #-------------------------------------------
+
+    def clear(self):
+        with self._lock:
+            self._curveDic = {}
+            self._cacheBytes =0
+
+    #-------------------------------------------
+
+#========================================
+
+class TrackMixer(object):
+    """ sums the tracks of a block, in one vectorized operation """
+    def __init__(self, frame_count=960, dtype=np.float32, max_tracks=16):
+        self._frameCount = frame_count
+        self._dtype = np.dtype(dtype)
+        self._outBuf = np.zeros(frame_count, dtype=self._dtype)
+        self._mixArr = None
+        self.set_maxTracks(max_tracks)
+
+    #-------------------------------------------
+
+    def set_maxTracks(self, nb_tracks):
+        """ preallocate the tracks by frames matrix, and its views for the whole blocks """
+        self._mixArr = np.zeros((nb_tracks, self._frameCount), dtype=self._dtype)
+        self._viewLst = [self._mixArr[0:nb] for nb in range(nb_tracks +1)]
+        self._rowLst = list(self._mixArr)
+
+    #-------------------------------------------
+
+    def mix_segment(self, track_lst, gain_arr, step_index, offset, out, env=None, step_len=0):
+        """
+        mix in out the tracks audio of a step segment, starting at offset,
+        with the gain curves of env for steps of step_len
+        """
+        nb_tracks = len(track_lst)
+        if nb_tracks == 0:
+            out.fill(0)
+            return out
+        if nb_tracks > len(self._mixArr):
+            self.set_maxTracks(nb_tracks)
+        if len(out) == self._frameCount:
+            # whole block, without views
+            mix_arr = self._viewLst[nb_tracks]
+            row_lst = self._rowLst
+        else:
+            mix_arr = self._mixArr[0:nb_tracks, 0:len(out)]
+            row_lst = mix_arr
+        row =0
+        while row < nb_tracks:
+            track_lst[row].read_step(step_index, offset, row_lst[row], env, step_len)
+            row +=1
+        np.dot(gain_arr, mix_arr, out=out)
+        
+        return out
+
     #-------------------------------------------
 
 #========================================
 
-class PortDriver(BaseDriver):
-    """ Port Audio Driver """
-    def __init__(self):
-        super().__init__()
-        self._stream = None
-        self._func_callback = None
+class StepScheduler(object):
+    """
+    Sample accurate step scheduler.
+    The playhead is kept in samples, and steps start at any offset in a block.
+    Step bounds are computed from the step count, with a fractional step length,
+    so they accumulate without drift
+    """
+    def __init__(self, rate=48000, step_len=24000.0):
+        self._rate = rate
+        self._stepLen = float(step_len) # in samples, fractional
+        self._nextStepLen = None # applied at the next step bound
+        self.reset()
 
     #-------------------------------------------
 
-    def set_streamCallback(self, func):
-        self._func_callback = func
+    def reset(self):
+        """ playhead at the start of the first step """
+        self._playPos =0 # in samples
+        self._stepCount =0 # steps played since reset
+        self._baseStep =0 # step count, and its start position,
+        self._basePos =0 # from where the bounds are computed
+        self._stepStart =0
+        self._stepEnd = self.get_stepPos(1)
 
     #-------------------------------------------
 
-    def open_stream(self):
-        self._stream = _pa.open(
-                    rate = self._rate,
-                    channels = self._channels,
-                    # format=pyaudio.paInt16,
-                    format = pyaudio.paFloat32,
-                    output=True,
-                    frames_per_buffer = self._frameCount, # 960
-                    start = False, # starting the callback function 
-                    stream_callback = self._func_callback
-                    )
+    def get_stepLen(self):
+        return self._stepLen
 
     #-------------------------------------------
-   
-    def init_driver(self):
-        self.open_stream()
+
+    def set_stepLen(self, step_len):
+        """ change step length, from the start of the current step """
+        self._nextStepLen = None
+        self._baseStep = self._stepCount
+        self._basePos = self._stepStart
+        self._stepLen = float(step_len)
+        self._stepEnd = max(self.get_stepPos(self._stepCount + 1), self._playPos + 1)
 
     #-------------------------------------------
 
-    def write(self, samp):
-        assert self._stream
-        self._stream.write(samp)
+    def change_stepLen(self, step_len):
+        """ change step length at the next step bound, without interrupting the playing """
+        if self._playPos == self._stepStart:
+            # at a bound, from this step
+            self.set_stepLen(step_len)
+        else:
+            self._nextStepLen = float(step_len)
 
     #-------------------------------------------
 
-    def start(self):
-        if not self._stream: return
-        self._stream.start_stream()
-       
+    def get_stepPos(self, step_count):
+        """ returns start position in samples of a step """
+        return self._basePos + round((step_count - self._baseStep) * self._stepLen)
+
     #-------------------------------------------
 
-    def stop(self):
-        if not self._stream: return
-        self._stream.stop_stream()
-       
+    def get_playPos(self):
+        return self._playPos
+
     #-------------------------------------------
-    
-    def close(self):
-        if self._stream:
-            self._stream.close()
-            _pa.terminate()
+
+    def get_stepCount(self):
+        return self._stepCount
 
     #-------------------------------------------
-    
-#========================================
 
-class WaveGenerator(object):
-    """ generate waveform """
-    def __init__(self, rate=44100, channels=1, _len=1):
-        self._rate = rate
-        self._channels = channels
-        self._len = _len
+    def get_curStepLen(self):
+        """ returns length in samples of the current step """
+        return self._stepEnd - self._stepStart
 
     #-------------------------------------------
 
-    def gen_samples(self, freq=440, _len=0):
-        if _len == 0:
-            _len = self._len
-        nb_samples = int(_len * self._rate)
-        # create an array
-        x = np.arange(nb_samples)
-        # the math function, is also the final sample
-        arr = np.sin(2 * np.pi * freq * x / self._rate, dtype='float64') # in float only
-        
-        return arr
+    def get_boundStep(self):
+        """ returns the step count starting at the playhead, or -1 inside a step """
+        if self._playPos >= self._stepEnd: return self._stepCount +1
+        if self._playPos == self._stepStart: return self._stepCount
+        return -1
 
     #-------------------------------------------
 
-    def gen_freq(self, arr, freq=440, _len=0):
-        """ generate frequency for an array in place """
-        if _len == 0:
-            _len = self._len
-        nb_samples = int(_len * self._rate)
-        # init the  array in place
-        # arr *= np.zeros(nb_samples, dtype='float32')
-        arr *= 0
-        x = np.arange(nb_samples)
-        
-        arr += np.sin(2 * np.pi * freq * x / self._rate, dtype='float64') # in float only
-        # arr1 = np.sin(2 * np.pi * freq * x / self._rate, dtype='float64') # in float only
-        # arr += arr1/2 # to be used later for effect
-        # print(f"arr: {arr.dtype}")
+    def next_segment(self, max_frames):
+        """
+        returns (step_count, offset, nb_frames) of the next segment,
+        in the current step, and advances the playhead
+        """
+        if self._playPos >= self._stepEnd:
+            self._stepCount +=1
+            self._stepStart = self._stepEnd
+            step_len = self._nextStepLen
+            if step_len is not None:
+                # new tempo, bounds computed from this step
+                self._nextStepLen = None
+                self._baseStep = self._stepCount
+                self._basePos = self._stepStart
+                self._stepLen = step_len
+            self._stepEnd = self.get_stepPos(self._stepCount + 1)
+        offset = self._playPos - self._stepStart
+        nb_frames = min(max_frames, self._stepEnd - self._playPos)
+        self._playPos += nb_frames
         
-        return arr
+        return (self._stepCount, offset, nb_frames)
 
     #-------------------------------------------
 
-
 #========================================
 
 class Pattern(object):
-    def __init__(self, bpm=120, rate=48000, nbNotes=4, sampLen=1):
+    def __init__(self, bpm=120, rate=48000, nbNotes=4, sampLen=1, dtype=np.float32, frameCount=960):
         self._nbClockMsec = 60000 # in millisec
         self._minBpm = 10
         self._maxBpm = 600
-        self._frameCount = 960
+        self._frameCount = frameCount
         self._rate = rate # in samples
         self._nbNotes = nbNotes
         self._sampLen = sampLen # in sec
@@ -183,10 +2183,7 @@ class Pattern(object):
             self._bpm = 120
         self._tempo = float(self._nbClockMsec / self._bpm) # in millisec
         self._nbSamples = int( (self._tempo * self._rate / 1000) * (4 / self._nbNotes) ) # in samples
-        self._sampLst = [] # [0] * self._nbNotes
         self._paramLst = []
-        self._frameLst = []
-        self._byteLst = []
         self._sampIndex =0
         self._frameIndex =0
         self._transpose =0
@@ -200,67 +2197,225 @@ class Pattern(object):
         self._restFrame = []
         """
 
+        self._dtype = np.dtype(dtype) # samples type
+        self._audioArr = None # contiguous steps audio, built on demand
         self._audioData = None
+        self._trackLst = []
+        self._srcLst = [] # for a snapshot, the edited tracks of its tracks
+        self._trackIndex =0
+        self._framesChanged = False
+        self._curTrack = Track() # track to edit
+        # gains of the audible tracks, for the mixer
+        self._activeLst = []
+        self._gainArr = np.zeros(0, dtype=self._dtype)
     
     #-------------------------------------------
 
+    def add_track(self, track):
+        """ add track, and returns its index """
+        self._trackLst.append(track)
+        if len(self._trackLst) == 1:
+            self.select_track(0)
+        self.update_gains()
+        
+        return len(self._trackLst) -1
+
+    #-------------------------------------------
+
+    def get_track(self, index):
+        try:
+            return self._trackLst[index]
+        except IndexError:
+            return
+
+    #-------------------------------------------
+
+    def copy(self):
+        """ returns a copy of the pattern and its tracks, frames built by gen_audio """
+        pat = Pattern(self._bpm, self._rate, self._nbNotes, self._sampLen, self._dtype, self._frameCount)
+        pat.set_bpm(self._bpm)
+        pat._transpose = self._transpose
+        pat._octave = self._octave
+        for track in self._trackLst:
+            pat.add_track(track.copy())
+        pat.select_track(self._trackIndex)
+
+        return pat
+
+    #-------------------------------------------
+
+    def make_snapshot(self, base=None):
+        """
+        returns a snapshot of the pattern to play, after base, its previous snapshot.
+        The unchanged tracks are shared with base, the changed ones copied,
+        and update_audio builds the frames of their changed steps only
+        """
+        pat = Pattern(self._bpm, self._rate, self._nbNotes, self._sampLen, self._dtype, self._frameCount)
+        pat.set_bpm(self._bpm)
+        pat._transpose = self._transpose
+        pat._octave = self._octave
+        base_dic = {}
+        pat._framesChanged = False
+        if base is not None:
+            base_dic = dict(zip(base._srcLst, base._trackLst))
+            # after a tempo change, the frames are built on demand
+            pat._framesChanged = (base._framesChanged or base._nbSamples != pat._nbSamples
+                    or base._frameCount != pat._frameCount)
+        if self._curTrack._pubSet or self._curTrack._pubAll:
+            self._audioArr = self._audioData = None
+        keep_frames = not pat._framesChanged
+        pat._trackLst = [track.make_snapshot(base_dic.get(track), keep_frames) for track in self._trackLst]
+        pat._srcLst = list(self._trackLst)
+        pat.select_track(self._trackIndex)
+        pat.update_gains()
+
+        return pat
+
+    #-------------------------------------------
+
+    def set_changed(self):
+        """ mark all the tracks changed, for the next snapshot """
+        for track in self._trackLst:
+            track.set_changed()
+
+    #-------------------------------------------
+
+    def get_trackList(self):
+        return self._trackLst
+
+    #-------------------------------------------
+
+    def get_trackIndex(self):
+        return self._trackIndex
+
+    #-------------------------------------------
+
+    def select_track(self, index):
+        """ select the track to edit """
+        if index >= 0 and index < len(self._trackLst):
+            self._trackIndex = index
+            self._curTrack = self._trackLst[index]
+            self._audioArr = self._audioData = None
+
+    #-------------------------------------------
+
+    def get_curTrack(self):
+        return self._curTrack
+
+    #-------------------------------------------
+
+    def update_gains(self):
+        """ compute gains of the audible tracks, after gain, mute or solo change """
+        track_lst = self._trackLst
+        is_solo = any(track.is_solo() for track in track_lst)
+        active_lst = []
+        for track in track_lst:
+            if track.is_muted(): continue
+            if is_solo and not track.is_solo(): continue
+            if track.get_gain() == 0: continue
+            active_lst.append(track)
+        self._gainArr = np.array([track.get_gain() for track in active_lst], dtype=self._dtype)
+        self._activeLst = active_lst
+
+    #-------------------------------------------
+
+    def get_activeTracks(self):
+        """ returns audible tracks and their gains """
+        return (self._activeLst, self._gainArr)
+
+    #-------------------------------------------
+
+    def set_streamOsc(self, osc):
+        self._curTrack.set_streamOsc(osc)
+
+    #-------------------------------------------
+
+    def is_streaming(self):
+        return self._curTrack.is_streaming()
+
+    #-------------------------------------------
    
     def get_bpm(self):
         return self._bpm
 
     #-------------------------------------------
 
+    def set_format(self, rate, frame_count):
+        """ sample rate and block size of the engine """
+        self._rate = rate
+        self._frameCount = frame_count
+        # recompute steps length for the rate
+        self.set_bpm(self._bpm)
+
+    #-------------------------------------------
+
+    def get_stepLen(self):
+        """ returns step length in samples, fractional """
+        return (self._tempo * self._rate / 1000) * (4 / self._nbNotes)
+
+    #-------------------------------------------
+
+    def get_nbSteps(self):
+        """ returns steps count of the pattern, from its first track """
+        if not self._trackLst: return 0
+        return len(self._trackLst[0].get_steps())
+
+    #-------------------------------------------
+
     def set_bpm(self, bpm):
+        """
+        steps longer than their audio are padded with silence by the scheduler,
+        so any bpm in range is accepted, without regenerating audio
+        """
         if bpm < self._minBpm: bpm = self._minBpm
         elif bpm > self._maxBpm: bpm = self._maxBpm
-        # TODO: make nbTimes and nbCount to sets bpm until 1 bpm with small sample data
-        max_samples = int( self._sampLen * self._rate )
         tempo = float(self._nbClockMsec / bpm) # in millisec
         nb_samples = int( (tempo * self._rate / 1000) ) # in samples
-        if nb_samples > max_samples:
-            return
         self._nbSamples = int( nb_samples * (4 / self._nbNotes) ) # in samples
         self._tempo = tempo
         self._bpm = bpm
-
-        # self.gen_audio()
+        # frames for the legacy renderers, rebuilt on demand
+        self._framesChanged = True
+        self._audioArr = self._audioData = None
 
     #-------------------------------------------
  
     def get_freq(self, index):
-        try:
-            return self._sampLst[index].freq
-        except IndexError:
-            return 0
+        return self._curTrack.get_freq(index)
     
     #-------------------------------------------
 
     def set_freq(self, index, freq):
-        if freq >= 0 and freq <= 20000:
-            try:
-                self._sampLst[index].freq = freq
-            except IndexError:
-                pass
+        self._curTrack.set_freq(index, freq)
     
     #-------------------------------------------
 
     def get_note(self, index):
-        try:
-            return self._sampLst[index].note
-        except IndexError:
-            return 0
+        return self._curTrack.get_note(index)
     
     #-------------------------------------------
 
     def set_note(self, index, note):
-        if note >= 0 and note <= 127:
-            try:
-                self._sampLst[index].note = note
-            except IndexError:
-                pass
+        self._curTrack.set_note(index, note)
     
     #-------------------------------------------
 
+    def set_notes(self, note_dic, freq_func):
+        return self._curTrack.set_notes(note_dic, freq_func)
+
+    #-------------------------------------------
+
+    def set_noteArray(self, index_arr, note_arr, freq_func):
+        return self._curTrack.set_noteArray(index_arr, note_arr, freq_func)
+
+    #-------------------------------------------
+
+    def get_steps(self):
+        """ returns steps store of the current track """
+        return self._curTrack.get_steps()
+
+    #-------------------------------------------
+
     def get_transpose(self):
         return self._transpose
     
@@ -284,112 +2439,367 @@ class Pattern(object):
     #-------------------------------------------
    
     def set_sample(self, index, samp):
-        try:
-            self._sampLst[index] = samp
-            # self.gen_audio()
-        except IndexError:
-            pass
+        self._curTrack.set_sample(index, samp)
  
     #-------------------------------------------
 
     def get_sample(self, index):
-        try:
-            return self._sampLst[index]
-        except IndexError:
-            return 
+        return self._curTrack.get_sample(index)
  
     #-------------------------------------------
       
     def set_sampleList(self, samp_lst):
-        """ init sample list """
-        self._sampLst = samp_lst
+        """ init sample list of the current track """
+        if not self._trackLst:
+            self.add_track(self._curTrack)
+        self._curTrack.set_sampleList(samp_lst)
+
+    #-------------------------------------------
+
+    def get_sampleList(self):
+        return self._curTrack.get_sampleList()
+
+    #-------------------------------------------
+
+    def set_frameList(self):
+        for track in self._trackLst:
+            track.set_frameList(self._nbSamples, self._frameCount)
+        self._framesChanged = False
+   
+    #-------------------------------------------
+
+    def get_frameList(self):
+        if self._framesChanged:
+            self.set_frameList()
+        return self._curTrack.get_frameList()
+
+    #-------------------------------------------
+
+    def gen_byteList(self):
+        if self._framesChanged:
+            self.set_frameList()
+        return self._curTrack.gen_byteList(self._nbSamples, self._frameCount)
+
+    #-------------------------------------------
+
+    def get_byteList(self):
+        return self._curTrack.get_byteList()
+
+    #-------------------------------------------
+
+
+    def gen_audio(self):
+        """
+        rebuild frames for all steps,
+        the contiguous audio data is built on demand by get_audioData
+        """
+        self.set_frameList()
+        # self.gen_byteList()
+        self._audioArr = self._audioData = None
+
+    #-------------------------------------------
+
+    def gen_audioData(self):
+        """ copy current track steps audio in contiguous data, for poll_audio """
+        if self.is_streaming(): return
+        nb_samples = self._nbSamples
+        samp_lst = self.get_sampleList()
+        # one row per step, updated in place by update_audio
+        self._audioArr = np.zeros((len(samp_lst), nb_samples), dtype=self._dtype)
+        for (index, samp) in enumerate(samp_lst):
+            data = samp.raw_data[0:nb_samples]
+            self._audioArr[index, 0:len(data)] = data
+        self._audioData = memoryview(self._audioArr).cast('B').toreadonly()
+        
+        return self._audioData
+
+    #-------------------------------------------
+
+    def set_dirty(self, index):
+        """ mark step at index of the current track, to be updated by update_audio """
+        self._curTrack.set_dirty(index)
+
+    #-------------------------------------------
+
+    def is_dirty(self):
+        return any(track.is_dirty() for track in self._trackLst)
+
+    #-------------------------------------------
+
+    def update_audio(self):
+        """ update frames and audio data for dirty steps only """
+        if self._framesChanged:
+            self.set_frameList()
+        for track in self._trackLst:
+            index_lst = track.update_frames(self._nbSamples, self._frameCount)
+            if track is self._curTrack and self._audioArr is not None:
+                samp_lst = track.get_sampleList()
+                if len(samp_lst) != len(self._audioArr):
+                    self._audioArr = self._audioData = None
+                    continue
+                for index in index_lst:
+                    data = samp_lst[index].raw_data[0:self._nbSamples]
+                    self._audioArr[index] =0
+                    self._audioArr[index, 0:len(data)] = data
+
+    #-------------------------------------------
+
+    def get_audioData(self):
+        if self._audioData is None:
+            self.gen_audioData()
+        return self._audioData
+
+    #-------------------------------------------
+
+
+#========================================
+
+class Song(object):
+    """ arrangement of patterns: chain of pattern indexes, with repeats count """
+    def __init__(self, pat_lst=None):
+        self._patLst = list(pat_lst) if pat_lst else []
+        self._chainLst = [] # (pattern index, repeats)
+        for index in range(len(self._patLst)):
+            self.add_entry(index)
+
+    #-------------------------------------------
+
+    def add_pattern(self, pat):
+        """ add pattern, and returns its index """
+        self._patLst.append(pat)
+        
+        return len(self._patLst) -1
+
+    #-------------------------------------------
+
+    def get_pattern(self, index):
+        if 0 <= index < len(self._patLst):
+            return self._patLst[index]
+
+    #-------------------------------------------
+
+    def get_patternList(self):
+        return self._patLst
+
+    #-------------------------------------------
+
+    def add_entry(self, pat_index, repeats=1):
+        """ append pattern to the chain """
+        if 0 <= pat_index < len(self._patLst) and repeats > 0:
+            self._chainLst.append((pat_index, repeats))
+
+    #-------------------------------------------
+
+    def set_chain(self, chain_lst):
+        """ set chain from list of (pattern index, repeats), ignoring invalid entries """
+        self._chainLst = []
+        for (pat_index, repeats) in chain_lst:
+            self.add_entry(pat_index, repeats)
+
+    #-------------------------------------------
+
+    def get_chain(self):
+        return self._chainLst
+
+    #-------------------------------------------
+
+    def get_entry(self, index):
+        """ returns (pattern, repeats) of the chain entry, or None """
+        if 0 <= index < len(self._chainLst):
+            (pat_index, repeats) = self._chainLst[index]
+            return (self._patLst[pat_index], repeats)
+
+    #-------------------------------------------
+
+    def get_nbEntries(self):
+        return len(self._chainLst)
+
+    #-------------------------------------------
+
+#========================================
+
+class PatternCache(object):
+    """
+    LRU cache of rendered pattern loops, by content hash, under a budget in bytes,
+    filled by prefetching threads
+    """
+    def __init__(self, cache_size=64*1024*1024):
+        self._cacheDic = OrderedDict()
+        self._cacheSize = cache_size
+        self._cacheBytes =0
+        self._cacheHits =0
+        self._cacheMisses =0
+        self._prefetchCount =0
+        self._pendingDic = {} # keys being prefetched: funcs called when rendered
+        self._lock = threading.Lock()
+
+    #-------------------------------------------
+
+    def get(self, key):
+        """ returns the rendered loop, or None """
+        with self._lock:
+            arr = self._cacheDic.get(key)
+            if arr is None:
+                self._cacheMisses +=1
+            else:
+                self._cacheDic.move_to_end(key)
+                self._cacheHits +=1
+        
+        return arr
+
+    #-------------------------------------------
+
+    def add(self, key, arr):
+        """ add rendered loop, evicting the least recently used ones """
+        with self._lock:
+            if arr.nbytes > self._cacheSize or key in self._cacheDic: return
+            self._cacheDic[key] = arr
+            self._cacheBytes += arr.nbytes
+            self.evict()
+
+    #-------------------------------------------
+
+    def evict(self):
+        while self._cacheDic and self._cacheBytes > self._cacheSize:
+            (_, old_arr) = self._cacheDic.popitem(last=False)
+            self._cacheBytes -= old_arr.nbytes
+
+    #-------------------------------------------
+
+    def prefetch(self, key, render_func, done_func=None):
+        """
+        render in a thread, if not in the cache nor being rendered,
+        done_func is called with the loop, at once when cached
+        """
+        with self._lock:
+            arr = self._cacheDic.get(key)
+            if arr is None:
+                func_lst = self._pendingDic.get(key)
+                if func_lst is not None:
+                    if done_func: func_lst.append(done_func)
+                    return
+                self._pendingDic[key] = [done_func] if done_func else []
+                self._prefetchCount +=1
+        if arr is not None:
+            if done_func: done_func(arr)
+            return
+        def func():
+            arr = None
+            try:
+                arr = render_func()
+                self.add(key, arr)
+            finally:
+                with self._lock:
+                    func_lst = self._pendingDic.pop(key, [])
+            for done in func_lst:
+                done(arr)
+        threading.Thread(target=func, daemon=True).start()
 
     #-------------------------------------------
 
-    def get_sampleList(self):
-        return self._sampLst
+    def set_cacheSize(self, nb_bytes):
+        with self._lock:
+            self._cacheSize = max(0, nb_bytes)
+            self.evict()
 
     #-------------------------------------------
 
-    def set_frameList(self):
-        # generate array of frames by reshaping
-        frame_count = self._frameCount
-        self._frameLst = []
-        samp_lst = self._sampLst
-        nb_samples = self._nbSamples
-        # reshape accept only a multiple of frame_count
-        (quo, rest) = divmod(nb_samples, frame_count)
-        if rest: nb_samples -= rest
-        for samp in samp_lst:
-            # no copy, just numpy view slicing
-            frame_arr = samp.raw_data[0:nb_samples].reshape(-1, frame_count)
-            self._frameLst.append(frame_arr)
-            # TODO: adding rest samples
-   
+    def clear(self):
+        with self._lock:
+            self._cacheDic.clear()
+            self._cacheBytes =0
+
     #-------------------------------------------
 
-    def get_frameList(self):
-        return self._frameLst
+    def get_info(self):
+        return {
+                "hits": self._cacheHits,
+                "misses": self._cacheMisses,
+                "prefetches": self._prefetchCount,
+                "entries": len(self._cacheDic),
+                "bytes": self._cacheBytes,
+                "size": self._cacheSize,
+                }
 
     #-------------------------------------------
 
-    def gen_byteList(self):
-        self._byteLst = []
-        samp_lst = self.get_sampleList()
-        nb_samples = self._nbSamples
-        # reshape accept only a multiple of frame_count
-        (quo, rest) = divmod(nb_samples, self._frameCount)
-        if rest: nb_samples -= rest
-        for samp in samp_lst:
-            # no copy, just numpy view slicing
-            row_lst = samp.raw_data[0:nb_samples].reshape(-1, self._frameCount)
-            byte_lst = [np.float32(arr).tobytes() for arr in row_lst]
-            self._byteLst.append(byte_lst)
-        
-        return self._byteLst
+#========================================
+
+class RenderWorker(object):
+    """
+    background thread running render jobs in order,
+    for the edits not to build audio while the callback reads it
+    """
+    def __init__(self, error_func=None):
+        self._jobQueue = queue.Queue()
+        self._thread = None
+        self._errorFunc = error_func
+        self._lock = threading.Lock()
 
     #-------------------------------------------
 
-    def get_byteList(self):
-        return self._byteLst
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run_thread, daemon=True)
+                self._thread.start()
 
     #-------------------------------------------
 
+    def _run_thread(self):
+        while 1:
+            job = self._jobQueue.get()
+            try:
+                if job is None: break
+                job()
+            except Exception as err:
+                # the next jobs are still run
+                if self._errorFunc: self._errorFunc(err)
+            finally:
+                self._jobQueue.task_done()
 
-    def gen_audio(self):
-        data_lst = []
-        nb_samples = self._nbSamples
-        self.set_frameList()
-        # self.gen_byteList()
-        samp_lst = self.get_sampleList()
-        for samp in samp_lst:
-            data_lst.append(samp.raw_data[0:nb_samples])
-        
-        audio_data = np.float32(data_lst).tobytes()
-        self._audioData = audio_data
-        
-        return audio_data
+    #-------------------------------------------
+
+    def post(self, job):
+        """ run job in the worker thread """
+        self.start()
+        self._jobQueue.put(job)
 
     #-------------------------------------------
 
-    def get_audioData(self):
-        return self._audioData
+    def wait(self):
+        """ blocks until the posted jobs are done """
+        self._jobQueue.join()
 
     #-------------------------------------------
 
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._jobQueue.put(None)
+            thread.join()
+
+    #-------------------------------------------
 
 #========================================
 
 class AudioManager(BaseDriver):
-    def __init__(self):
-        super().__init__()
-        self._audioDriver = PortDriver()
+    def __init__(self, driver="port", ring_frames=0, rate=48000, frame_count=960, **driver_args):
+        frame_count = limit_value(frame_count, self._minFrameCount, self._maxFrameCount)
+        super().__init__(rate, frame_count)
+        self._audioDriver = make_driver(driver, **driver_args)
+        self._audioDriver.set_format(self._rate, self._frameCount)
         _len =2 # in sec
-        self._waveGen = WaveGenerator(self._rate, self._channels, _len)
+        self._dtype = np.float32 # samples type for the whole pipeline
+        self._waveGen = WaveGenerator(self._rate, self._channels, _len, dtype=self._dtype)
+        self._sampleBank = SampleBank(self._rate, self._dtype)
         self._midTools = miditools
         self._audioData = None
         self._dataLen =0
-        self._deqData = deque()
+        self._ringFrames = ring_frames # 0 for default
+        self._ringBuf = self.make_ringBuffer()
         self._deqIndex =0
         self._index =0
         self._curPat = None # for pattern
@@ -402,6 +2812,49 @@ class AudioManager(BaseDriver):
         self._durLst = [0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64]
         self._quantLen =0
         self._quantIndex =0
+        self._synthMode = "prerender"
+        self._sampLen =6 # in secs, prerendered steps length
+        self._mixer = TrackMixer(self._frameCount, self._dtype)
+        self._envTable = EnvelopeTable(self._rate, self._dtype, frame_count=self._frameCount)
+        self._sched = StepScheduler(self._rate)
+        self._blockBuf = np.zeros(self._frameCount, dtype=self._dtype)
+        self._unitGain = np.ones(1, dtype=self._dtype)
+        self._stats = CallbackStats(self._frameCount, self._rate)
+        self._silentData = memoryview(np.zeros(self._frameCount, dtype=np.float32)).toreadonly()
+        self._song = Song()
+        self._songMode = False
+        self._nextSongMode = False # switched by the callback, at its next block
+        self._songSched = StepScheduler(self._rate) # for the loops mixed live
+        self._offline = False # offline renders wait for the song loops
+        self._patCache = PatternCache()
+        self._renderLock = threading.Lock() # for rendering patterns from threads
+        self.init_songPos()
+        # double buffering: the edits are made on _curPat,
+        # the callback plays a snapshot, swapped at a step or bar bound
+        self._playPat = None # snapshot played by the callback
+        self._nextPat = None # last published snapshot of _curPat
+        self._pollPat = None # snapshot of the poll_audio data
+        self._snapDic = {} # edited pattern: its last snapshot, for the song
+        self._pubDic = {} # edited pattern: its last published snapshot
+        self._loopDic = {} # song pattern: (snapshot, key, rendered loop or None)
+        self._pubLock = threading.Lock()
+        self._swapMode = "step" # or bar
+        self._pubNs =0 # time of the last publishing
+        self._swapLatency =0 # in ns, from the publishing to the swap
+        self._worker = RenderWorker(lambda err: self.print_info(f"Render error: {err}"))
+
+    #-------------------------------------------
+
+    def set_audioDriver(self, driver="port", **driver_args):
+        """ replace the audio driver, before init_audioDriver """
+        self._audioDriver.close()
+        self._audioDriver = make_driver(driver, **driver_args)
+        self._audioDriver.set_format(self._rate, self._frameCount)
+
+    #-------------------------------------------
+
+    def get_audioDriver(self):
+        return self._audioDriver
 
     #-------------------------------------------
 
@@ -413,6 +2866,7 @@ class AudioManager(BaseDriver):
 
     def close_audioDriver(self):
         self._audioDriver.close()
+        self._worker.stop()
 
     #-------------------------------------------
 
@@ -428,19 +2882,127 @@ class AudioManager(BaseDriver):
         
         for samp in sampLst:
             smp.extend(samp[0:24000])
-        smp = np.float32(smp).tobytes()
+        smp = np.asarray(smp, dtype=np.float32).tobytes()
         while 1:
             self._audioDriver.write(smp)
 
     #-------------------------------------------
 
+    def make_ringBuffer(self):
+        """ returns new ring buffer for the block size """
+        # default: the block used by the driver, and 2 blocks ahead
+        nb_frames = self._ringFrames
+        if not nb_frames: nb_frames = 3 * self._frameCount
+        return RingBuffer(nb_frames, self._frameCount)
+
+    #-------------------------------------------
+
+    def set_ringCapacity(self, nb_frames):
+        """ replace the ring buffer, when the stream is stopped """
+        self._ringFrames = nb_frames
+        self._ringBuf = self.make_ringBuffer()
+
+    #-------------------------------------------
+
+    def set_engineFormat(self, rate=0, frame_count=0):
+        """
+        change sample rate and block size of the whole engine:
+        driver stream, ring buffer, mixer, scheduler and patterns
+        """
+        if not rate: rate = self._rate
+        if not frame_count: frame_count = self._frameCount
+        frame_count = limit_value(frame_count, self._minFrameCount, self._maxFrameCount)
+        if rate == self._rate and frame_count == self._frameCount: return
+        driver = self._audioDriver
+        playing = self._playing
+        opened = driver.is_opened()
+        if playing: driver.stop()
+        if opened: driver.close_stream()
+        rate_changed = (rate != self._rate)
+        self.set_format(rate, frame_count)
+        driver.set_format(rate, frame_count)
+        self._ringBuf = self.make_ringBuffer()
+        self._mixer = TrackMixer(frame_count, self._dtype)
+        self._blockBuf = np.zeros(frame_count, dtype=self._dtype)
+        self._envTable.set_frameCount(frame_count)
+        self._sched = StepScheduler(rate)
+        self._songSched = StepScheduler(rate)
+        self._stats.set_budget(frame_count, rate)
+        self._silentData = memoryview(np.zeros(frame_count, dtype=np.float32)).toreadonly()
+        if rate_changed:
+            wave_gen = self._waveGen
+            self._waveGen = WaveGenerator(rate, self._channels, wave_gen._len, 
+                    wave_gen._cacheSize, self._dtype)
+            self._waveGen.set_waveform(wave_gen.get_waveform())
+            self._sampleBank.set_rate(rate)
+            self._envTable.set_rate(rate)
+        if self._curPat:
+            self._curPat.set_format(rate, frame_count)
+            # new oscillators or buffers for the format
+            self.change_pattern(self._synthMode)
+        for pat in self._song.get_patternList():
+            if pat is not self._curPat:
+                pat.set_format(rate, frame_count)
+                self.change_pattern(self._synthMode, pat)
+        # snapshots for the new format, and the scheduler at its rate
+        self.init_pos()
+        self._songData = None
+        if opened: driver.open_stream()
+        if playing:
+            self._ringBuf.reset()
+            driver.start()
+
+    #-------------------------------------------
+
+    def change_blockSize(self, frame_count):
+        self.set_engineFormat(0, frame_count)
+        self.show_latency()
+
+    #-------------------------------------------
+
+    def change_rate(self, rate):
+        if rate >= 8000 and rate <= 192000:
+            self.set_engineFormat(rate, 0)
+        self.show_latency()
+
+    #-------------------------------------------
+
+    def get_latency(self):
+        """ returns output latency in secs: ring buffer, and driver stream """
+        ring_frames = self._ringBuf.get_capacity() - self._frameCount
+        return ring_frames / self._rate + self._audioDriver.get_latency()
+
+    #-------------------------------------------
+
+    def show_latency(self):
+        block_ms = self._frameCount / self._rate * 1000
+        ring_ms = (self._ringBuf.get_capacity() - self._frameCount) / self._rate * 1000
+        stream_ms = self._audioDriver.get_latency() * 1000
+        msg = (f"Rate: {self._rate} Hz, block: {self._frameCount} frames ({block_ms:.2f} msec), "
+                f"ring: {ring_ms:.2f} msec, stream: {stream_ms:.2f} msec, "
+                f"total latency: {self.get_latency() * 1000:.2f} msec")
+        self.print_info(msg)
+
+    #-------------------------------------------
+
+    def is_ringFull(self):
+        """ whether no more block can be rendered """
+        return self._ringBuf.get_writeSpace() < self._frameCount
+
+    #-------------------------------------------
+
     def get_bufData(self):
-        if len(self._deqData):
-            return self._deqData.popleft()
+        # zero copy, read only bytes like object
+        return self._ringBuf.read_bytes(self._frameCount)
 
     #-------------------------------------------
     
     def poll_audio(self):
+        pat = self.take_pattern()
+        if self._audioData is None or pat is not self._pollPat:
+            self._pollPat = pat
+            self._audioData = pat.get_audioData()
+            self._dataLen = len(self._audioData)
         assert self._audioData
         step = self._index + self._frameBytes # frame_count * 4 # 4 for float size
         try:
@@ -458,15 +3020,15 @@ class AudioManager(BaseDriver):
 
     def render_audio1(self):
         """ First implementation """
-        nb_data =4
-        if len(self._deqData) > nb_data/2: return
-        samp_lst = self._curPat.get_sampleList()
+        if self._ringBuf.get_readSpace() > self._ringBuf.get_capacity() / 2: return
+        pat = self.take_pattern()
+        samp_lst = pat.get_sampleList()
         while 1:
-            if len(self._deqData) >= nb_data: break
+            if self.is_ringFull(): break
             if self._sampIndex >= len(samp_lst):
                 self._sampIndex =0
             samp = samp_lst[self._sampIndex]
-            raw_data = samp.raw_data[0:self._curPat._nbSamples]
+            raw_data = samp.raw_data[0:pat._nbSamples]
             step = self._index + self._frameCount
             
             try:
@@ -475,8 +3037,7 @@ class AudioManager(BaseDriver):
                     self._sampIndex +=1
                 audioData = samp.raw_data[self._index:step]
                 self._index += self._frameCount
-                audioData = np.float32(audioData).tobytes()
-                self._deqData.append(audioData)
+                self._ringBuf.write(audioData)
             except IndexError:
                 pass
         
@@ -484,34 +3045,32 @@ class AudioManager(BaseDriver):
 
     def render_audio2(self):
         """ 2nd implementation """
-        nb_data =4
-        if self._sampChanged or self._sampIndex == 0:
-            self._deqData.clear()
-        elif not self._sampChanged and len(self._deqData) > nb_data/2: 
+        if self._sampChanged:
+            self._ringBuf.clear()
+            self._index =0
+        elif self.is_ringFull(): 
             return
 
-        samp_lst = self._curPat.get_sampleList()
+        pat = self.take_pattern()
+        samp_lst = pat.get_sampleList()
         if self._sampIndex >= len(samp_lst):
             self._sampIndex =0
-        # print(f"sampIndex: {self._sampIndex}, len deq: {len(self._deqData)}")
         samp = samp_lst[self._sampIndex]
-        nb_samples = self._curPat._nbSamples
+        nb_samples = pat._nbSamples
         # reshape accept only a multiple of frame_count
         (quo, rest) = divmod(nb_samples, self._frameCount)
         if rest: nb_samples -= rest
         # no copy, just numpy view slicing
-        raw_data = samp.raw_data[0:nb_samples].reshape(-1, self._frameCount)
+        raw_data = samp.get_data(nb_samples).reshape(-1, self._frameCount)
         
-        # print("Len deq before loop: ", len(self._deqData))
-        
-        # """
-        for audio_data in raw_data:
-            self._deqData.append(
-                    np.float32(audio_data).tobytes()
-                    )
-        # """
-        # print("Len deq after loop: ", len(self._deqData))
-        self._sampIndex +=1
+        # the step frames, as much as the ring buffer can take
+        while self._index < len(raw_data):
+            if self.is_ringFull(): break
+            self._ringBuf.write(raw_data[self._index])
+            self._index +=1
+        if self._index >= len(raw_data):
+            self._index =0
+            self._sampIndex +=1
         self._sampChanged =0
 
     #-------------------------------------------
@@ -519,83 +3078,267 @@ class AudioManager(BaseDriver):
     def render_audio(self):
         """
         render_audio3
-        3nd implementation with deque object 
-        """
-        cur_pat = self._curPat
-        frame_lst = cur_pat.get_frameList()
-        if not frame_lst: return
-        samp_index = cur_pat._sampIndex
-        frame_index = cur_pat._frameIndex
-        nb_data =2
-        if len(self._deqData) > nb_data/2: return
-
-        # print(f"First sampIndex: {samp_index}, Len frame_lst: {len(frame_lst)}")
-        # print(f"frame_index: {frame_index}")
-        index_starting = samp_starting =0
-
-        if samp_index >= len(frame_lst): 
-            frame_arr = frame_lst[0]
-            # samp_starting =1
-        else:
-            frame_arr = frame_lst[samp_index]
+        3nd implementation with ring buffer object and step scheduler
+        """
+        if self._nextSongMode != self._songMode:
+            # from the producer side of the ring buffer
+            self.switch_songMode(self._nextSongMode)
+        cur_pat = self._playPat
+        if not cur_pat or not cur_pat.get_nbSteps(): return
+        ring = self._ringBuf
+        while 1:
+            # mixed in place in the ring buffer
+            block = ring.get_writeBuffer(self._frameCount)
+            if block is None: break
+            self.render_block(block)
+            ring.commit(self._frameCount)
+
+    #-------------------------------------------
+
+    def render_block(self, block=None):
+        """
+        render the next block in block, the block buffer by default,
+        steps starting at any offset in it
+        returns the block
+        """
+        if block is None: block = self._blockBuf
+        if self._songMode:
+            return self.render_songBlock(block)
+        self.mix_block(self._playPat, self._sched, self._mixer, block, live=True)
+        
+        return self.get_mixData(block)
+
+    #-------------------------------------------
+
+    def mix_block(self, pat, sched, mixer, block, live=False):
+        """
+        mix the pattern tracks in block, from the scheduler position,
+        live: swapping to the published pattern at a step or bar bound
+        """
+        nb_steps = pat.get_nbSteps()
+        (track_lst, gain_arr) = self.get_mixTracks(pat)
+        frame_count = len(block)
+        pos =0
+        while pos < frame_count:
+            next_pat = self._nextPat
+            if live and next_pat is not pat and next_pat is not None:
+                step_count = sched.get_boundStep()
+                if step_count >= 0 and (self._swapMode == "step" or step_count % nb_steps == 0):
+                    pat = self.swap_pattern(next_pat)
+                    nb_steps = pat.get_nbSteps()
+                    (track_lst, gain_arr) = self.get_mixTracks(pat)
+            (step_count, offset, nb_frames) = sched.next_segment(frame_count - pos)
+            seg = block if nb_frames == frame_count else block[pos:pos+nb_frames]
+            mixer.mix_segment(track_lst, gain_arr, step_count % nb_steps, offset, seg,
+                    self._envTable, sched.get_curStepLen())
+            pos += nb_frames
+
+    #-------------------------------------------
+
+    def get_mixTracks(self, pat):
+        """ returns the tracks to mix, and their gains """
+        if self._isMixing:
+            return pat.get_activeTracks()
+        
+        return ([pat.get_curTrack()], self._unitGain)
+
+    #-------------------------------------------
+
+    def get_patternKey(self, pat):
+        """ returns hash of the pattern content, and the parameters changing its rendering """
+        (track_lst, gain_arr) = self.get_mixTracks(pat)
+        param_lst = [self._rate, np.dtype(self._dtype).str, self._synthMode, self._waveGen.get_waveform(),
+                self._envTable.get_params(), pat.get_stepLen(), pat.get_nbSteps(), len(track_lst)]
+        hsh = hashlib.blake2b(repr(param_lst).encode(), digest_size=16)
+        hsh.update(np.ascontiguousarray(gain_arr, dtype=np.float64).tobytes())
+        for track in track_lst:
+            steps = track.get_steps()
+            for arr in (steps.get_notes(), steps.get_freqs(), steps.get_velocities(),
+                    steps.get_gates(), steps.get_actives(), steps.get_lens()):
+                hsh.update(arr.tobytes())
+            hsh.update(repr(steps.get_fileList()).encode())
+        
+        return hsh.hexdigest()
+
+    #-------------------------------------------
+
+    def render_pattern(self, pat):
+        """ returns a read only loop of the pattern, mixed by the same path than render_block """
+        if any(track.is_streaming() for track in pat.get_trackList()):
+            # own oscillators, the playing ones keep their phase
+            pat = pat.copy()
+            for track in pat.get_trackList():
+                if track.is_streaming():
+                    track.set_streamOsc(StreamOsc(self._waveGen, self._frameCount))
+        with self._renderLock:
+            step_len = pat.get_stepLen()
+            total = round(pat.get_nbSteps() * step_len)
+            sched = StepScheduler(self._rate, step_len)
+            mixer = TrackMixer(self._frameCount, self._dtype)
+            out = np.zeros(total, dtype=self._dtype)
+            for pos in range(0, total, self._frameCount):
+                self.mix_block(pat, sched, mixer, out[pos:pos+self._frameCount])
+        out.flags.writeable = False
+        
+        return out
+
+    #-------------------------------------------
+
+    def get_patternRender(self, pat):
+        """ returns the rendered loop of the pattern, from the cache if possible """
+        key = self.get_patternKey(pat)
+        arr = self._patCache.get(key)
+        if arr is None:
+            arr = self.render_pattern(pat)
+            self._patCache.add(key, arr)
         
-        if frame_index >= len(frame_arr): 
-            audio_data = frame_arr[0]
+        return arr
+
+    #-------------------------------------------
+
+    def get_chainPatterns(self):
+        """ returns the patterns of the song chain, once each """
+        pat_lst = []
+        for index in range(self._song.get_nbEntries()):
+            (pat, _) = self._song.get_entry(index)
+            if not any(pat is item for item in pat_lst):
+                pat_lst.append(pat)
+
+        return pat_lst
+
+    #-------------------------------------------
+
+    def update_songLoop(self, pat, snap=None):
+        """
+        resolve the loop of the song pattern for the callback, out of it:
+        from the cache, or rendered in a thread, mixed live until ready
+        """
+        if snap is None: snap = self._snapDic.get(pat, pat)
+        key = self.get_patternKey(snap)
+        def set_loop(data):
+            with self._pubLock:
+                item = self._loopDic.get(pat)
+                # superseded by a newer snapshot or key
+                if data is not None and item is not None \
+                        and (item[0] is not snap or item[1] != key): return
+                loop_dic = dict(self._loopDic)
+                loop_dic[pat] = (snap, key, data)
+                # replaced, not modified, for the callback reading it
+                self._loopDic = loop_dic
+        set_loop(None)
+        self._patCache.prefetch(key, lambda: self.render_pattern(snap), set_loop)
+
+    #-------------------------------------------
+
+    def update_songLoops(self):
+        """ resolve the loops of the chain patterns, in song mode """
+        if not self._nextSongMode: return
+        for pat in self.get_chainPatterns():
+            self.update_songLoop(pat)
+
+    #-------------------------------------------
+
+    def init_songPos(self):
+        """ song playhead at the start of the chain """
+        self._songEntry =0
+        self._songRepeat =0
+        self._songPos =0
+        self._songData = None
+        self._songPat = None # snapshot mixed live, while its loop is rendered
+        self._songLen =0
+
+    #-------------------------------------------
+
+    def load_songEntry(self):
+        """
+        set the loop of the current chain entry, resolved out of the callback.
+        Until its render is ready, the entry is mixed live,
+        offline renders wait for it
+        """
+        song = self._song
+        nb_entries = song.get_nbEntries()
+        if not nb_entries: return
+        if self._songEntry >= nb_entries: self._songEntry =0
+        (pat, _) = song.get_entry(self._songEntry)
+        if self._offline:
+            snap = self._snapDic.get(pat, pat)
+            data = self.get_patternRender(snap)
         else:
-            audio_data = frame_arr[frame_index]
+            item = self._loopDic.get(pat)
+            if item is None:
+                snap = self._snapDic.get(pat, pat)
+                data = None
+            else:
+                (snap, _, data) = item
+        self._songData = data
+        if data is None:
+            step_len = snap.get_stepLen()
+            self._songPat = snap
+            self._songLen = round(snap.get_nbSteps() * step_len)
+            self._songSched.set_stepLen(step_len)
+            self._songSched.reset()
+        else:
+            self._songPat = None
+            self._songLen = len(data)
 
-        while 1:
-            if len(self._deqData) >= nb_data: break
-           
-            if frame_index >= len(frame_arr):
-                frame_index =0
-                cur_pat._frameIndex = frame_index
-                index_starting =1
-            
-            if index_starting:
+    #-------------------------------------------
 
-                if samp_index >= len(frame_lst) -1:
-                    samp_index =0
-                    cur_pat._sampIndex = samp_index
-                else:
-                    samp_index +=1
-                    cur_pat._sampIndex = samp_index
-                    samp_starting =1
-                    index_starting =0
-    
-            try:
-                audio_data = frame_arr[frame_index]
-                if self._isMixing:
-                    audio_data = self.get_mixData(frame_index, audio_data)
-                audio_data = np.float32(audio_data).tobytes()
-                self._deqData.append(audio_data)
-                # print("Len deq after loop: ", len(self._deqData))
-                frame_index +=1
-                cur_pat._sampIndex = samp_index
-                cur_pat._frameIndex = frame_index
-                samp_starting =0
+    def next_songLoop(self):
+        """ go to the next repeat, or the next chain entry """
+        self._songPos =0
+        self._songRepeat +=1
+        entry = self._song.get_entry(self._songEntry)
+        if entry is None or self._songRepeat >= entry[1]:
+            self._songRepeat =0
+            self._songEntry +=1
+        # the loop is taken again from the cache, with the last edits
+        self._songData = None
+        self._songPat = None
 
-            except IndexError:
-                pass
+    #-------------------------------------------
+
+    def render_songBlock(self, block):
+        """
+        render in block the next block of the song, from the rendered loops of the chain,
+        or mixed live when not yet rendered
+        """
+        frame_count = len(block)
+        pos =0
+        while pos < frame_count:
+            if self._songData is None and self._songPat is None:
+                self.load_songEntry()
+                if self._songData is None and self._songPat is None: # empty chain
+                    block[pos:] =0
+                    break
+            data = self._songData
+            nb = min(frame_count - pos, self._songLen - self._songPos)
+            if data is not None:
+                block[pos:pos+nb] = data[self._songPos:self._songPos+nb]
+            else:
+                self.mix_block(self._songPat, self._songSched, self._mixer, block[pos:pos+nb])
+            pos += nb
+            self._songPos += nb
+            if self._songPos >= self._songLen:
+                self.next_songLoop()
+        
+        return self.get_mixData(block)
 
     #-------------------------------------------
 
-    def get_mixData(self, index, data):
-        """ transform audio data """
-        data = data.copy()
-        if self._quantLen:
-            self.set_quantizeLen(index, data)
-        data *= self._vol
+    def get_mixData(self, data):
+        """ transform audio data in place, returns it """
+        if self._vol != 1:
+            np.multiply(data, self._vol, out=data)
         
         return data
+
     #-------------------------------------------
 
     def render_audio4(self):
-        """ 4nd implementation with deque object and bytes string list """
-        byte_lst = self._curPat.get_byteList()
+        """ 4nd implementation with ring buffer object and bytes string list """
+        byte_lst = self.take_pattern().get_byteList()
         if not byte_lst: return
-        nb_data =2
-        if len(self._deqData) > nb_data/2: return
+        if self.is_ringFull(): return
 
         # print(f"First sampIndex: {self._sampIndex}, Len byte_lst: {len(byte_lst)}")
         
@@ -613,7 +3356,7 @@ class AudioManager(BaseDriver):
             audio_data = row_lst[self._index]
 
         while 1:
-            if len(self._deqData) >= nb_data: break
+            if self.is_ringFull(): break
             
             if self._index >= len(row_lst):
                 self._index =0
@@ -626,8 +3369,7 @@ class AudioManager(BaseDriver):
             try:
                 row_lst = byte_lst[self._sampIndex]
                 audio_data = row_lst[self._index]
-                self._deqData.append(audio_data)
-                # print("Len deq after loop: ", len(self._deqData))
+                self._ringBuf.write(np.frombuffer(audio_data, dtype=np.float32))
                 self._index +=1
                 samp_changed =0
 
@@ -640,36 +3382,83 @@ class AudioManager(BaseDriver):
 
     def is_audioReady(self):
         # Deprecated
-        return len(self._deqData)
+        return self._ringBuf.get_readSpace()
     
     #-------------------------------------------
 
     def _func_callback(self, in_data, frame_count, time_info, status):
         # print("frame_count: ", frame_count)
-        data = None
+        start = time.perf_counter_ns()
         
         # data = self.poll_audio()
-        # print("len deque: ", len(self._deqData))
         self.render_audio()
         data = self.get_bufData() 
+        is_empty = data is None
+        if is_empty:
+            # silence, not to stop the stream
+            data = self._silentData
+        self._stats.record(time.perf_counter_ns() - start, status, is_empty)
+        
+        return (data, _paContinue)
+
+    #-------------------------------------------
+
+    def make_track(self, midnote_lst, name=""):
+        """ returns new track with a step by note """
+        samp_len = self._sampLen
+        track = Track(name)
+        if self._synthMode == "stream":
+            # one oscillator by track, for its monophonic voice
+            track.set_streamOsc(StreamOsc(self._waveGen, self._frameCount))
+        steps = StepStore(len(midnote_lst))
+        steps.get_notes()[:] = midnote_lst
+        steps.get_freqs()[:] = self._midTools.mid2freq(steps.get_notes())
+        steps.get_lens()[:] = samp_len
+        if not track.is_streaming():
+            # synthesized in one pass
+            buf_lst = self._waveGen.gen_multi(steps.get_freqs().tolist(), samp_len)
+            for (index, buf) in enumerate(buf_lst):
+                steps.set_data(index, buf)
+        track.set_steps(steps)
+
+        return track
+
+    #-------------------------------------------
+
+    def init_pattern(self, bpm=120, nb_tracks=1, nb_steps=4):
+        """ create new pattern, as the only one of the song, and returns it """
+        pat = self.make_pattern(bpm, nb_tracks, nb_steps)
+        self.set_song(Song([pat]))
+        self._curPat = pat
+        self.init_params()
         
-        return (data, pyaudio.paContinue)
+        return pat
+
+    #-------------------------------------------
+
+    def set_song(self, song):
+        """
+        replace the song, and forget the snapshots of its previous patterns,
+        the pending publishings of them are dropped
+        """
+        with self._pubLock:
+            self._song = song
+            self._snapDic = {}
+            self._pubDic = {}
+            self._loopDic = {}
 
     #-------------------------------------------
 
-    def init_pattern(self, bpm=120):
-        """ create new pattern and returns audio data """
-        audioData = []
-        samp_len =6 # in secs
-        pat = Pattern(bpm, sampLen=samp_len)
-        samp_lst = []
-        midnote_lst = [60, 64, 67, 72]    
-        for note in midnote_lst:
-            freq = self._midTools.mid2freq(note) # C5
-            samp_obj = SampleObj(freq=freq, _len=samp_len)
-            samp_obj.note = note
-            samp_obj.raw_data = self._waveGen.gen_samples(samp_obj.freq, samp_obj.data_len)
-            samp_lst.append(samp_obj)
+    def make_pattern(self, bpm=120, nb_tracks=1, nb_steps=4):
+        """ returns new pattern """
+        pat = Pattern(bpm, self._rate, sampLen=self._sampLen, dtype=self._dtype, frameCount=self._frameCount)
+        chord_lst = [60, 64, 67, 72]
+        # the chord notes repeated for nb_steps
+        midnote_lst = [chord_lst[i % len(chord_lst)] for i in range(nb_steps)]
+        for i in range(nb_tracks):
+            # next tracks an octave lower
+            note_lst = [note - 12 * min(i, 4) for note in midnote_lst]
+            pat.add_track(self.make_track(note_lst, f"Track {i+1}"))
 
         """
         sampLst = [self._waveGen.gen_samples(880, samp_len),
@@ -678,36 +3467,375 @@ class AudioManager(BaseDriver):
                 self._waveGen.gen_samples(700, samp_len),
                 ]
         """
-        pat.set_sampleList(samp_lst)
+        # frames built on the snapshots, by publish_pattern
+        
+        return pat
+
+    #-------------------------------------------
+
+    def get_pattern(self):
+        """ returns the pattern to edit """
+        return self._curPat
+
+    #-------------------------------------------
+
+    def get_playPattern(self):
+        """ returns the snapshot played by the callback """
+        return self._playPat
+
+    #-------------------------------------------
+
+    def publish_pattern(self, pat=None, now=False):
+        """
+        publish a snapshot of the pattern edits, the current pattern by default,
+        sharing the unchanged tracks with the previous snapshot.
+        While playing, the frames of the changed steps are built by the render worker,
+        and the callback swaps to it at the next step or bar bound
+        """
+        if pat is None: pat = self._curPat
+        if pat is None: return
+        self._pubNs = time.perf_counter_ns()
+        with self._pubLock:
+            base = self._pubDic.get(pat)
+            # the changed steps are copied before the next edit
+            snap = pat.make_snapshot(base)
+            self._pubDic[pat] = snap
+        track_lst = snap.get_trackList()
+        if base is not None and base.get_stepLen() == snap.get_stepLen():
+            # curves of the shared tracks already computed
+            base_set = set(map(id, base.get_trackList()))
+            track_lst = [track for track in track_lst if id(track) not in base_set]
+        def job():
+            # even when superseded, the next snapshots reuse these frames
+            if not snap._framesChanged:
+                snap.update_audio()
+            self.prepare_curves(snap, track_lst)
+            with self._pubLock:
+                # superseded by a newer edit
+                if self._pubDic.get(pat) is not snap: return
+                snap_dic = dict(self._snapDic)
+                snap_dic[pat] = snap
+                # replaced, not modified, for the threads reading it
+                self._snapDic = snap_dic
+                if pat is self._curPat:
+                    self._nextPat = snap
+            if self._nextSongMode and any(pat is item for item in self.get_chainPatterns()):
+                # loop rendered before the callback reaches it
+                self.update_songLoop(pat, snap)
+        if self._playing and not now:
+            self._worker.post(job)
+        else:
+            # after the pending jobs, building the frames of the previous snapshots
+            self._worker.wait()
+            job()
+            if pat is self._curPat:
+                self.swap_pattern(snap)
+
+    #-------------------------------------------
+
+    def prepare_curves(self, pat, track_lst=None):
+        """ compute the gate curves of the pattern steps, or of track_lst, out of the callback """
+        if track_lst is None: track_lst = pat.get_trackList()
+        gate_set = set()
+        for track in track_lst:
+            gate_set.update(np.unique(track.get_steps().get_gates()).tolist())
+        self._envTable.prepare(pat.get_stepLen(), gate_set)
+
+    #-------------------------------------------
+
+    def swap_pattern(self, pat):
+        """ play the snapshot pat, with its step length, and returns it """
+        self._playPat = pat
+        self._swapLatency = time.perf_counter_ns() - self._pubNs
+        step_len = pat.get_stepLen()
+        if step_len != self._sched.get_stepLen():
+            self._sched.change_stepLen(step_len)
+
+        return pat
+
+    #-------------------------------------------
 
-        audioData = pat.gen_audio()
+    def take_pattern(self):
+        """
+        returns the snapshot to play, swapped at once to the published one,
+        for the renderers without step scheduler
+        """
+        next_pat = self._nextPat
+        if next_pat is not None and next_pat is not self._playPat:
+            self.swap_pattern(next_pat)
         
+        return self._playPat
+
+    #-------------------------------------------
+
+    def sync_pattern(self):
+        """ wait for the render worker, and play the last published snapshot """
+        self._worker.wait()
+        self.take_pattern()
+
+    #-------------------------------------------
+
+    def get_swapLatency(self):
+        """ returns time in secs from the last edit to its swap in the callback """
+        return self._swapLatency / 1e9
+
+    #-------------------------------------------
+
+    def set_swapMode(self, mode):
+        """ edits heard at the next step, or at the next pattern loop """
+        if mode in ("step", "bar"):
+            self._swapMode = mode
+        self.print_info(f"Swap mode: {self._swapMode}")
+
+    #-------------------------------------------
+
+    def get_ringBuffer(self):
+        return self._ringBuf
+
+    #-------------------------------------------
+
+    def save_session(self, filename):
+        """ save the pattern parameters and its steps audio """
+        assert self._curPat
+        pat = self._curPat
+        buf_lst = []
+        buf_dic = {} # buffer id: block index, shared buffers saved once
+        track_lst = []
+        for track in pat.get_trackList():
+            step_lst = []
+            for samp in track.get_sampleList():
+                block = -1
+                if samp.is_file(): pass # loaded from the file
+                elif samp.raw_data is not None:
+                    block = buf_dic.get(id(samp.raw_data))
+                    if block is None:
+                        block = buf_dic[id(samp.raw_data)] = len(buf_lst)
+                        buf_lst.append(samp.raw_data)
+                step_lst.append({"note": samp.note, "freq": samp.freq, 
+                    "len": samp.data_len, "block": block, "file": samp.filename,
+                    "velocity": samp.velocity, "gate": samp.gate, "active": samp.active})
+            track_lst.append({"name": track.get_name(), "gain": track.get_gain(), 
+                "muted": track.is_muted(), "solo": track.is_solo(), "steps": step_lst})
+        meta_dic = {
+                "rate": self._rate,
+                "bpm": pat.get_bpm(),
+                "transpose": pat.get_transpose(),
+                "octave": pat.get_octave(),
+                "quantize": self._quantLen,
+                "envelope": list(self._envTable.get_envelope()),
+                "track_index": pat.get_trackIndex(),
+                "tracks": track_lst,
+                }
+        sess = SessionFile(filename)
+        sess.save(meta_dic, buf_lst, self._dtype)
+        self.print_info(f"Session saved to {sess.get_metaFile()}")
+
+    #-------------------------------------------
+
+    def load_session(self, filename):
+        """
+        load pattern from session file, steps audio memory mapped,
+        synthesized only when missing or saved at another rate
+        returns the pattern
+        """
+        sess = SessionFile(filename)
+        (meta_dic, block_lst) = sess.load()
+        if meta_dic["rate"] != self._rate: block_lst = []
+        pat = Pattern(meta_dic["bpm"], self._rate, sampLen=self._sampLen, dtype=self._dtype, frameCount=self._frameCount)
+        pat.set_transpose(meta_dic["transpose"])
+        pat.set_octave(meta_dic["octave"])
+        streaming = self._synthMode == "stream"
+        for track_dic in meta_dic["tracks"]:
+            track = Track(track_dic["name"], track_dic["gain"])
+            track.set_muted(track_dic["muted"])
+            track.set_solo(track_dic["solo"])
+            if streaming:
+                track.set_streamOsc(StreamOsc(self._waveGen, self._frameCount))
+            steps = StepStore()
+            len_dic = {} # steps to synthesize, by length
+            for step in track_dic["steps"]:
+                index = steps.append(step["freq"], step["note"], step["len"], filename=step.get("file", ""))
+                samp = steps.get_view(index)
+                samp.velocity = step.get("velocity", 1)
+                samp.gate = step.get("gate", 1)
+                samp.active = step.get("active", True)
+                block = step["block"]
+                if samp.is_file():
+                    samp.raw_data = self._sampleBank.get_sample(samp.filename)
+                elif streaming: pass
+                elif 0 <= block < len(block_lst) and block_lst[block].dtype == self._dtype:
+                    samp.raw_data = block_lst[block]
+                else:
+                    len_dic.setdefault(samp.data_len, []).append(samp)
+            for (samp_len, lst) in len_dic.items():
+                buf_lst = self._waveGen.gen_multi([samp.freq for samp in lst], samp_len)
+                for (samp, buf) in zip(lst, buf_lst):
+                    samp.raw_data = buf
+            track.set_steps(steps)
+            pat.add_track(track)
+        pat.select_track(meta_dic.get("track_index", 0))
+        if meta_dic.get("quantize", 0) in self._durLst:
+            self._quantLen = meta_dic["quantize"]
+            self._quantIndex = self._durLst.index(self._quantLen)
+            self._envTable.set_quantizeLen(self._quantLen)
+        if "envelope" in meta_dic:
+            self._envTable.set_envelope(*meta_dic["envelope"])
+        self.set_song(Song([pat]))
+        self._curPat = pat
+        self.init_params()
+        self.print_info(f"Session loaded from {sess.get_metaFile()}")
+
+        return pat
+
+    #-------------------------------------------
+
+    def new_pattern(self):
+        """ add new pattern to the song, with the tracks count of the current one """
+        bpm =120
+        nb_tracks =1
+        if self._curPat:
+            bpm = self._curPat.get_bpm()
+            nb_tracks = len(self._curPat.get_trackList())
+        pat = self.make_pattern(bpm, nb_tracks)
+        index = self._song.add_pattern(pat)
+        self.select_pattern(index)
+
+    #-------------------------------------------
+
+    def select_pattern(self, index):
+        """ select the song pattern to edit, and to play in pattern mode """
+        pat = self._song.get_pattern(index)
+        if pat is None: return
         self._curPat = pat
         self.init_params()
+        self.show_song()
+
+    #-------------------------------------------
+
+    def change_chain(self, entry_lst):
+        """ set the song chain from strings: pattern index, or pattern index:repeats """
+        chain_lst = []
+        for entry in entry_lst:
+            (index, _, repeats) = entry.partition(":")
+            try:
+                chain_lst.append((int(index), int(repeats) if repeats else 1))
+            except ValueError:
+                pass
+        self._song.set_chain(chain_lst)
+        self.update_songLoops()
+        self.show_song()
+
+    #-------------------------------------------
+
+    def set_songMode(self, song_mode):
+        """
+        play the song chain, or the current pattern.
+        While playing, switched by the callback at its next block
+        """
+        self._nextSongMode = song_mode
+        # loops rendered in threads, mixed live until ready
+        self.update_songLoops()
+        if not self._playing:
+            self.switch_songMode(song_mode)
+
+    #-------------------------------------------
+
+    def switch_songMode(self, song_mode):
+        """ switch the mode from the start of the song, called by the ring buffer producer """
+        self._songMode = song_mode
+        self.init_songPos()
+        self._ringBuf.clear()
 
+    #-------------------------------------------
+
+    def toggle_songMode(self):
+        song_mode = not self._nextSongMode
+        self.set_songMode(song_mode)
+        self.print_info(f"Song mode: {song_mode}")
+
+    #-------------------------------------------
+
+    def get_songLen(self):
+        """ returns length in samples of the song chain """
+        total =0
+        for index in range(self._song.get_nbEntries()):
+            (pat, repeats) = self._song.get_entry(index)
+            total += repeats * round(pat.get_nbSteps() * pat.get_stepLen())
         
-        return audioData
+        return total
+
+    #-------------------------------------------
+
+    def show_song(self):
+        song = self._song
+        for (index, pat) in enumerate(song.get_patternList()):
+            cur = "*" if pat is self._curPat else " "
+            self.print_info(f"{cur}Pattern {index}: {pat.get_nbSteps()} steps, bpm: {pat.get_bpm()}")
+        chain_str = " ".join(f"{index}:{repeats}" for (index, repeats) in song.get_chain())
+        self.print_info(f"Chain: {chain_str}, song mode: {self._songMode}")
 
     #-------------------------------------------
 
     def get_data(self):
-        audioData = []
         if self._curPat is None:
-            audioData = self.init_pattern()
+            self.init_pattern()
        
-        return audioData
+        return self._curPat.get_audioData()
+
+    #-------------------------------------------
+    
+    def set_synthMode(self, mode):
+        """ prerender: steps audio in memory, stream: generated on the fly """
+        if mode in ("prerender", "stream"):
+            if mode != self._synthMode:
+                self._synthMode = mode
+                if self._curPat:
+                    self.change_pattern(mode)
+
+    #-------------------------------------------
+
+    def change_synthMode(self, mode):
+        self.set_synthMode(mode)
+        msg = f"Synth mode: {self._synthMode}"
+        self.print_info(msg)
+
+    #-------------------------------------------
+
+    def change_pattern(self, mode, pat=None):
+        """ rebuild the pattern steps for the synth mode, the current pattern by default """
+        if pat is None: pat = self._curPat
+        for track in pat.get_trackList():
+            if mode == "stream":
+                track.set_streamOsc(StreamOsc(self._waveGen, self._frameCount))
+                for samp in track.get_sampleList():
+                    if samp.is_file():
+                        samp.raw_data = self._sampleBank.get_sample(samp.filename)
+                    else:
+                        samp.raw_data = None
+            else:
+                track.set_streamOsc(None)
+                for samp in track.get_sampleList():
+                    if samp.is_file():
+                        samp.raw_data = self._sampleBank.get_sample(samp.filename)
+                    else:
+                        samp.raw_data = self._waveGen.gen_samples(samp.freq, samp.data_len)
+        pat.set_changed()
+        if pat is self._curPat:
+            self.init_params()
+        else:
+            self.publish_pattern(pat)
 
     #-------------------------------------------
-    
+
     def change_bpm(self, bpm, adding=0):
         if not self._curPat: return
         cur_bpm = self._curPat.get_bpm()
         if adding == 1: # is incremental
             bpm += cur_bpm
 
+        # applied by the scheduler at the swap, no audio to regenerate
         self._curPat.set_bpm(bpm)
-        self._curPat.gen_audio()
-        self.init_params()
+        self.publish_pattern()
         cur_bpm = self._curPat.get_bpm()
         msg = f"Bpm: {cur_bpm}"
         self.print_info(msg)
@@ -724,11 +3852,11 @@ class AudioManager(BaseDriver):
         assert samp_obj
         samp_obj.freq = freq
         samp_len = samp_obj.data_len 
-        # change samp_obj.raw_data in place
-        # samp_obj.raw_data = 
-        self._waveGen.gen_freq(samp_obj.raw_data, freq, samp_len)
-        # print(f"raw_data: {samp_obj.raw_data.dtype}")
-        self._curPat.gen_audio()
+        if not self._curPat.is_streaming() and not samp_obj.is_file():
+            # shared buffer from the wave generator cache
+            samp_obj.raw_data = self._waveGen.gen_samples(freq, samp_len)
+        # only the edited step is copied in the next snapshot
+        self._curPat.set_dirty(index)
         self.init_params()
         freq = self._curPat.get_freq(index)
         if msg is None:
@@ -751,6 +3879,121 @@ class AudioManager(BaseDriver):
 
     #-------------------------------------------
 
+    def change_notes(self, note_dic, msg=None):
+        """
+        change several notes from a dict of step index: note,
+        synthesizing and rebuilding the pattern once
+        """
+        index_arr = np.fromiter(note_dic.keys(), dtype=np.int64, count=len(note_dic))
+        note_arr = np.fromiter(note_dic.values(), dtype=np.int64, count=len(note_dic))
+        self.change_noteArray(index_arr, note_arr, msg)
+
+    #-------------------------------------------
+
+    def change_noteArray(self, index_arr, note_arr, msg=None):
+        """
+        change the notes at indexes, in array operations,
+        synthesizing and rebuilding the pattern once
+        """
+        assert self._curPat
+        pat = self._curPat
+        steps = pat.get_steps()
+        index_lst = pat.set_noteArray(index_arr, note_arr, self._midTools.mid2freq)
+        # sample files are not pitched by the notes
+        synth_lst = [index for index in index_lst if not steps.is_file(index)]
+        if pat.is_streaming(): synth_lst = []
+        synth_arr = np.array(synth_lst, dtype=np.int64)
+        len_arr = steps.get_lens()[synth_arr]
+        # group steps by length, to synthesize them in one pass
+        for samp_len in np.unique(len_arr).tolist():
+            sel_arr = synth_arr[len_arr == samp_len]
+            buf_lst = self._waveGen.gen_multi(steps.get_freqs()[sel_arr].tolist(), samp_len)
+            for (index, buf) in zip(sel_arr.tolist(), buf_lst):
+                steps.set_data(index, buf)
+        if index_lst:
+            self.init_params()
+        if msg is None:
+            msg = f"Notes: {[pat.get_note(index) for index in index_lst]}"
+        if msg:
+            self.print_info(msg)
+
+    #-------------------------------------------
+
+    def toggle_step(self, index):
+        """ set step active or inactive, read as silence """
+        assert self._curPat
+        samp = self._curPat.get_sample(index)
+        if not samp: return
+        samp.active = not samp.active
+        self._curPat.set_dirty(index)
+        self.publish_pattern()
+        self.print_info(f"Step {index} active: {samp.active}")
+
+    #-------------------------------------------
+
+    def change_velocity(self, index, velo):
+        assert self._curPat
+        samp = self._curPat.get_sample(index)
+        if not samp: return
+        samp.velocity = limit_value(velo, 0, 1)
+        self._curPat.set_dirty(index)
+        self.publish_pattern()
+        self.print_info(f"Step {index} velocity: {samp.velocity:.2f}")
+
+    #-------------------------------------------
+
+    def change_gate(self, index, gate):
+        """ gate length of the step, as fraction of the step length """
+        assert self._curPat
+        samp = self._curPat.get_sample(index)
+        if not samp: return
+        samp.gate = limit_value(gate, 0, 1)
+        self._curPat.set_dirty(index)
+        self.publish_pattern()
+        self.print_info(f"Step {index} gate: {samp.gate:.2f}")
+
+    #-------------------------------------------
+
+    def change_sample(self, index, filename=""):
+        """ 
+        assign a wav file to a step of the current track,
+        or the synthesized note when no filename
+        """
+        assert self._curPat
+        pat = self._curPat
+        samp = pat.get_sample(index)
+        if not samp: return
+        if filename:
+            try:
+                samp.raw_data = self._sampleBank.get_sample(filename)
+            except (OSError, ValueError) as err:
+                self.print_info(f"Sample error: {err}")
+                return
+            samp.filename = filename
+            samp.data_len = len(samp.raw_data) / self._rate
+            msg = f"Step {index} sample: {filename}"
+        else:
+            samp.filename = ""
+            samp.data_len = self._sampLen
+            samp.raw_data = None
+            if not pat.is_streaming():
+                samp.raw_data = self._waveGen.gen_samples(samp.freq, samp.data_len)
+            msg = f"Step {index} note: {samp.note}"
+        pat.set_dirty(index)
+        self.init_params()
+        self.print_info(msg)
+
+    #-------------------------------------------
+
+    def shift_notes(self, num):
+        """ shift all the notes of the pattern by num semitones """
+        note_arr = self._curPat.get_steps().get_notes().astype(np.int64)
+        # out of range notes are left unchanged by change_noteArray
+        note_arr += num
+        self.change_noteArray(np.arange(len(note_arr)), note_arr, msg="")
+
+    #-------------------------------------------
+
     def change_transpose(self, num, adding=0):
         assert self._curPat
         if adding == 1:
@@ -759,15 +4002,8 @@ class AudioManager(BaseDriver):
             val = num 
             num -= self._curPat.get_transpose()
         if val >=-12 and val <=12:
-            samp_lst = self._curPat.get_sampleList()
             self._curPat.set_transpose(val)
-            for (index, samp) in enumerate(samp_lst):
-                note = self._curPat.get_note(index)
-                note += num
-                self._curPat.set_note(index, note)
-                freq = self._midTools.mid2freq(note)
-                self.change_freq(index, freq, adding=0, msg="")
-            
+            self.shift_notes(num)
         
         note = self._curPat.get_note(0)
         val = self._curPat.get_transpose()
@@ -784,16 +4020,9 @@ class AudioManager(BaseDriver):
             val = num 
             num -= self._curPat.get_octave()
         if val >=0 and val <=8:
-            samp_lst = self._curPat.get_sampleList()
             self._curPat.set_octave(val)
             num *= 12 # 12 notes by  octave
-            for (index, samp) in enumerate(samp_lst):
-                note = self._curPat.get_note(index)
-                note += num
-                self._curPat.set_note(index, note)
-                freq = self._midTools.mid2freq(note)
-                self.change_freq(index, freq, adding=0, msg="")
-            
+            self.shift_notes(num)
         
         note = self._curPat.get_note(0)
         val = self._curPat.get_octave()
@@ -802,6 +4031,77 @@ class AudioManager(BaseDriver):
 
     #-------------------------------------------
 
+    def add_track(self):
+        """ add track with the steps count of the pattern """
+        assert self._curPat
+        pat = self._curPat
+        nb_steps = pat.get_nbSteps()
+        note_lst = [pat.get_note(index) for index in range(nb_steps)]
+        index = len(pat.get_trackList())
+        # the other tracks are shared with the previous snapshot
+        pat.add_track(self.make_track(note_lst, f"Track {index+1}"))
+        self.select_track(index)
+
+    #-------------------------------------------
+
+    def select_track(self, index):
+        """ select the track to edit """
+        assert self._curPat
+        self._curPat.select_track(index)
+        self.publish_pattern()
+        self.show_tracks()
+
+    #-------------------------------------------
+
+    def show_tracks(self):
+        assert self._curPat
+        pat = self._curPat
+        for (index, track) in enumerate(pat.get_trackList()):
+            cur = "*" if index == pat.get_trackIndex() else " "
+            flags = ("M" if track.is_muted() else "-") + ("S" if track.is_solo() else "-")
+            msg = f"{cur}{index}: {track.get_name()}, gain: {track.get_gain():.1f}, {flags}"
+            self.print_info(msg)
+
+    #-------------------------------------------
+
+    def change_trackGain(self, index, num, adding=0):
+        assert self._curPat
+        track = self._curPat.get_track(index)
+        if not track: return
+        if adding == 1:
+            num += track.get_gain()
+        track.set_gain(num)
+        self._curPat.update_gains()
+        self.publish_pattern()
+        msg = f"Track {index} gain: {track.get_gain():.1f}"
+        self.print_info(msg)
+
+    #-------------------------------------------
+
+    def toggle_mute(self, index):
+        assert self._curPat
+        track = self._curPat.get_track(index)
+        if not track: return
+        track.set_muted(not track.is_muted())
+        self._curPat.update_gains()
+        self.publish_pattern()
+        msg = f"Track {index} mute: {track.is_muted()}"
+        self.print_info(msg)
+
+    #-------------------------------------------
+
+    def toggle_solo(self, index):
+        assert self._curPat
+        track = self._curPat.get_track(index)
+        if not track: return
+        track.set_solo(not track.is_solo())
+        self._curPat.update_gains()
+        self.publish_pattern()
+        msg = f"Track {index} solo: {track.is_solo()}"
+        self.print_info(msg)
+
+    #-------------------------------------------
+
     def change_volume(self, num, adding=0):
         assert self._curPat
         if adding == 1:
@@ -830,6 +4130,9 @@ class AudioManager(BaseDriver):
             nb_samples = self._curPat._nbSamples
             self._quantLen = self._durLst[quant_index]
             self._quantIndex = quant_index
+            self._envTable.set_quantizeLen(self._quantLen)
+            self.prepare_curves(self._curPat)
+            self.update_songLoops()
        
         quant_len = self._quantLen
         msg = f"Quantize len: {quant_len}"
@@ -837,38 +4140,228 @@ class AudioManager(BaseDriver):
 
     #-------------------------------------------
 
-    def set_quantizeLen(self, index, audio_data):
-      
-        quant_len = self._quantLen
-        if quant_len >1:
-            nb_samples = int(self._curPat._nbSamples / quant_len)
-            quant_index = int(nb_samples / self._frameCount)
-            if index >= quant_index:
-                audio_data *= 0
-        """
-        msg = f"Quantize index: {quant_index}"
+    def change_envelope(self, val_lst):
+        """ set the envelope from strings: attack, decay in msec, sustain level, release in msec """
+        env_lst = list(self._envTable.get_envelope())
+        for (index, val) in enumerate(val_lst[0:4]):
+            val = float(val)
+            env_lst[index] = val if index == 2 else val / 1000
+        self._envTable.set_envelope(*env_lst)
+        if self._curPat: self.prepare_curves(self._curPat)
+        self.update_songLoops()
+        (attack, decay, sustain, release) = self._envTable.get_envelope()
+        msg = (f"Envelope: attack {attack * 1000:.1f} msec, decay {decay * 1000:.1f} msec, "
+                f"sustain {sustain:.2f}, release {release * 1000:.1f} msec")
         self.print_info(msg)
+
+    #-------------------------------------------
+
+    def get_loopLen(self, nb_loops=1):
+        """ returns length in samples of nb_loops of the current pattern, or of the song """
+        if self._songMode:
+            return nb_loops * self.get_songLen()
+        if not self._curPat: return 0
+        pat = self._curPat
+        return round(nb_loops * pat.get_nbSteps() * pat.get_stepLen())
+
+    #-------------------------------------------
+
+    def render_offline(self, nb_loops=1, writer=None):
+        """
+        render the current pattern faster than realtime, without audio driver,
+        using the same path than the stream callback.
+        returns float32 array, or the number of frames when writing to writer
+        """
+        if not self._curPat: return
+        total_frames = self.get_loopLen(nb_loops)
+        self.init_pos()
+        self.init_songPos()
+        self._ringBuf.reset()
+        out_data = None
+        if writer is None:
+            out_data = np.zeros(total_frames, dtype=np.float32)
+        nb_frames =0
+        self._offline = True
+        try:
+            while nb_frames < total_frames:
+                self.render_audio()
+                data = self.get_bufData()
+                if data is None: break
+                # the data view is only valid until the next read
+                nb = min(self._frameCount, total_frames - nb_frames)
+                if writer is None:
+                    out_data[nb_frames:nb_frames+nb] = np.frombuffer(data, dtype=np.float32)[0:nb]
+                else:
+                    writer.write(data[0:nb])
+                nb_frames += nb
+        finally:
+            self._offline = False
+        self._ringBuf.reset()
+        self.init_pos()
+        self.init_songPos()
+        if writer is not None:
+            return nb_frames
+        
+        return out_data[0:nb_frames]
+
+    #-------------------------------------------
+
+    def bounce(self, filename, nb_loops=1):
+        """ render the current pattern to a wav file """
+        writer = WavWriter(filename, self._rate, self._channels)
+        writer.open()
+        try:
+            nb_frames = self.render_offline(nb_loops, writer)
+        finally:
+            writer.close()
+        
+        return nb_frames
+
+    #-------------------------------------------
+
+    def get_batchSize(self, session, nb_loops=1):
+        """
+        returns (nb_tracks, nb_frames) of a session to bounce,
+        from its metadata only, for the shared memory size
+        """
+        meta_dic = SessionFile(session).load_meta()
+        track_lst = meta_dic["tracks"]
+        nb_steps = len(track_lst[0]["steps"]) if track_lst else 0
+        # step length at the engine rate, as computed by the pattern
+        pat = Pattern(meta_dic["bpm"], self._rate)
+        pat.set_bpm(meta_dic["bpm"])
+        
+        return (len(track_lst), round(nb_loops * nb_steps * pat.get_stepLen()))
+
+    #-------------------------------------------
+
+    def render_batch(self, session_lst, out_dir="", nb_loops=1, nb_procs=0):
+        """
+        bounce session files to wav files in out_dir, in a process pool,
+        a job by track, rendered in shared memory, and mixed here.
+        Each process loads a session once, for all its jobs
+        returns list of the wav files
         """
+        # only needed by the batch mode
+        import multiprocessing
+        from multiprocessing import shared_memory
+        if not nb_procs: nb_procs = os.cpu_count() or 1
+        ctx = multiprocessing.get_context("spawn")
+        init_args = (self._rate, self._frameCount, self._synthMode)
+        out_lst = []
+        with ctx.Pool(nb_procs, _init_batchProcess, init_args) as pool:
+            # sessions by chunks, to bound the shared memory in use
+            chunk_size = 2 * nb_procs
+            for start in range(0, len(session_lst), chunk_size):
+                chunk_lst = []
+                job_lst = []
+                try:
+                    for session in session_lst[start:start+chunk_size]:
+                        (nb_tracks, nb_frames) = self.get_batchSize(session, nb_loops)
+                        nb_bytes = max(1, nb_tracks * nb_frames * 4)
+                        shm = shared_memory.SharedMemory(create=True, size=nb_bytes)
+                        chunk_lst.append((session, shm, nb_tracks, nb_frames))
+                        for index in range(nb_tracks):
+                            job_lst.append((session, index, nb_loops, shm.name, nb_tracks, nb_frames))
+                    for _ in pool.imap_unordered(_render_batchJob, job_lst):
+                        pass
+                    for (session, shm, nb_tracks, nb_frames) in chunk_lst:
+                        track_arr = np.ndarray((nb_tracks, nb_frames), dtype=np.float32, buffer=shm.buf)
+                        filename = self.write_batchMix(session, track_arr, out_dir)
+                        del track_arr
+                        out_lst.append(filename)
+                finally:
+                    for (_, shm, _, _) in chunk_lst:
+                        shm.close()
+                        shm.unlink()
+        
+        return out_lst
+
+    #-------------------------------------------
+
+    def write_batchMix(self, session, track_arr, out_dir=""):
+        """ mix the rendered tracks of a session, and write it to wav file """
+        base = os.path.splitext(os.path.basename(session))[0]
+        filename = os.path.join(out_dir or os.path.dirname(session), base + ".wav")
+        mix = np.sum(track_arr, axis=0, dtype=np.float32)
+        mix *= self._vol
+        writer = WavWriter(filename, self._rate, self._channels)
+        writer.open()
+        try:
+            writer.write(mix)
+        finally:
+            writer.close()
+        
+        return filename
+
+    #-------------------------------------------
+
+    def get_stats(self):
+        return self._stats
 
+    #-------------------------------------------
+
+    def show_stats(self, cmd="", filename=""):
+        """ print callback statistics, cmd: reset or json """
+        stats = self._stats
+        if cmd == "reset":
+            stats.reset()
+            self.print_info("Stats reset")
+            return
+        elif cmd == "json":
+            data = stats.dump_json(filename)
+            msg = f"Stats written to {filename}" if filename else data
+            self.print_info(msg)
+            return
+        dic = stats.get_dict()
+        msg = (f"Callbacks: {dic['callbacks']}, budget: {dic['budget_us']:.0f} usec, "
+                f"mean: {dic['mean_us']:.1f} usec ({dic['mean_load'] * 100:.1f} %), "
+                f"max: {dic['max_us']:.1f} usec ({dic['max_load'] * 100:.1f} %)\n"
+                f"Overruns: {dic['overruns']}, underflows: {dic['underflows']}, "
+                f"overflows: {dic['overflows']}, empty buffers: {dic['empty_buffers']}")
+        self.print_info(msg)
+        hist_str = ", ".join(f"{key}: {val}" for (key, val) in dic["histogram"].items() if val)
+        self.print_info(f"Histogram: {hist_str}")
 
     #-------------------------------------------
 
+    def show_cacheInfo(self):
+        info = self._waveGen.get_cacheInfo()
+        msg = (f"Wave cache: {info['entries']} buffers, "
+                f"{info['bytes'] / 1048576:.1f}/{info['size'] / 1048576:.1f} MB, "
+                f"hits: {info['hits']}, misses: {info['misses']}")
+        self.print_info(msg)
+        info = self._patCache.get_info()
+        msg = (f"Pattern cache: {info['entries']} loops, "
+                f"{info['bytes'] / 1048576:.1f}/{info['size'] / 1048576:.1f} MB, "
+                f"hits: {info['hits']}, misses: {info['misses']}, prefetches: {info['prefetches']}")
+        self.print_info(msg)
+        info = self._sampleBank.get_info()
+        msg = (f"Sample bank: {info['files']} files, {info['mapped']} memory mapped, "
+                f"{info['bytes'] / 1048576:.1f} MB decoded")
+        self.print_info(msg)
 
+    #-------------------------------------------
 
     def init_pos(self):
         if not self._curPat: return
+        self.sync_pattern()
+        pat = self._playPat
         self._index =0
         self._sampIndex =0
-        self._curPat._frameIndex =0
-        self._curPat._sampIndex =0
+        pat._frameIndex =0
+        pat._sampIndex =0
+        self._sched.set_stepLen(pat.get_stepLen())
+        self._sched.reset()
 
     #-------------------------------------------
 
     def init_params(self):
+        """ publish the current pattern, from its start when not playing """
         if self._curPat:
-            self._audioData = self._curPat.get_audioData()
-            self._dataLen = len(self._audioData)
-            self.init_pos()
+            self.publish_pattern()
+            if not self._playing:
+                self.init_pos()
             self._sampChanged =1
 
     #-------------------------------------------
@@ -876,6 +4369,8 @@ class AudioManager(BaseDriver):
     def play(self):
         # self.write_data()
         self.init_pos()
+        self.init_songPos()
+        self._ringBuf.reset()
         self._audioDriver.start()
         self._playing = True
         self.print_info("Play Start")
@@ -900,6 +4395,8 @@ class AudioManager(BaseDriver):
         if self._playing or self._pausing:
             self._audioDriver.stop()
             self.init_pos()
+            # with the mode not yet switched by the callback
+            self.switch_songMode(self._nextSongMode)
             self._playing = False
             self._pausing = False
             self.print_info("Stop")
@@ -911,42 +4408,49 @@ class AudioManager(BaseDriver):
 
     #-------------------------------------------
     
-    def perf(self, nb_times=1_000_000, nb_repeats=7):
+    def bench_tracks(self, nb_blocks=200, max_tracks=4096):
         """
-        using the timeit module for short function
-        Note: poll_audio is faster than render_audio, when calling with arguments.
-        But, it is the inverse result when calling with no arguments
-        WHY???
+        measure the render time by block, for an increasing tracks count,
+        on a headless audio manager with the same format, not on the playing one
+        returns the max tracks count sustained in realtime
         """
+        bench_man = AudioManager("null", rate=self._rate, frame_count=self._frameCount)
+        bench_man.print_info = lambda msg: None
+        bench_man.set_synthMode(self._synthMode)
+        budget = self._frameCount / self._rate # in secs
+        max_count =0
+        nb_tracks =1
+        self.print_info(f"Block size: {self._frameCount} frames, budget: {budget * 1e3:.2f} msec")
+        try:
+            while nb_tracks <= max_tracks:
+                bench_man.init_pattern(nb_tracks=nb_tracks)
+                bench_man.init_pos()
+                bench_man.get_ringBuffer().reset()
+                start = time.perf_counter()
+                for _ in range(nb_blocks):
+                    bench_man.render_audio()
+                    bench_man.get_bufData()
+                dur = (time.perf_counter() - start) / nb_blocks
+                load = dur / budget
+                self.print_info(f"Tracks: {nb_tracks:4d}, {dur * 1e6:9.1f} usec/block, {load * 100:6.1f} % of budget")
+                if load >= 1: break
+                max_count = nb_tracks
+                nb_tracks *= 2
+        finally:
+            bench_man.close_audioDriver()
+        self.print_info(f"Max tracks in realtime: {max_count}")
+        
+        return max_count
 
+    #-------------------------------------------
 
-        # nb_times = 1_000_000
-        # nb_repeats =7
-        func1 = """ 
-def f():
-    return self.poll_audio()
-"""
-
-        func2 = """ 
-def f():
-    self.render_audio()
-    data = self.get_bufData()
-"""
-
-
-        """
-        val = timeit.timeit(stmt=func1, number=1000000)
-        print(f"poll_audio time: {val}")
-        val = timeit.timeit(stmt=func2, number=1000000)
-        print(f"render_audio time: {val}")
-        """
-
-        time_lst = timeit.repeat(stmt=func1, number=nb_times, repeat=nb_repeats)
-        print("min time for poll_audio: {:0.6f}".format(min(time_lst)))
-        time_lst = timeit.repeat(stmt=func2, number=nb_times, repeat=nb_repeats)
-        print("min time for render_audio:  {:0.6f}".format(min(time_lst)))
-         # """
+    def perf(self, nb_blocks=200):
+        """ run the benchmark suite of the render paths, headless """
+        import stepybench
+        results = stepybench.run_suite(nb_blocks)
+        stepybench.print_results(results)
 
+        return results
 
     #-----------------------------------------
 
@@ -954,17 +4458,97 @@ def f():
     def test(self):
         print("Test\n")
         
-        nb_times = 1_000_000
-        nb_repeats =7
-        self.perf(nb_times, nb_repeats)
+        self.perf()
         
     #-------------------------------------------
 
 #========================================
 
+_batchMan = None # audio manager of a batch process
+_batchSessDic = OrderedDict() # session file: its loaded state, in a batch process
+_BATCH_SESSIONS = 8 # sessions kept loaded by a batch process
+
+def _init_batchProcess(rate, frame_count, synth):
+    """ init the audio manager of a pool process, its caches kept between jobs """
+    global _batchMan
+    _batchMan = AudioManager("null", rate=rate, frame_count=frame_count)
+    _batchMan.print_info = lambda msg: None
+    _batchMan.set_synthMode(synth)
+
+#------------------------------------------------------------------------------
+
+def _load_batchSession(session):
+    """
+    returns the session pattern, loaded once by batch process,
+    in its loaded state: tracks muting, quantize and envelope
+    """
+    audi_man = _batchMan
+    item = _batchSessDic.get(session)
+    if item is None:
+        pat = audi_man.load_session(session)
+        state_lst = [(track.is_muted(), track.is_solo()) for track in pat.get_trackList()]
+        item = (pat, state_lst, audi_man._quantIndex, audi_man._envTable.get_envelope())
+        _batchSessDic[session] = item
+        if len(_batchSessDic) > _BATCH_SESSIONS:
+            _batchSessDic.popitem(last=False)
+        return pat
+    _batchSessDic.move_to_end(session)
+    (pat, state_lst, quant_index, env) = item
+    for (track, (muted, solo)) in zip(pat.get_trackList(), state_lst):
+        track.set_muted(muted)
+        track.set_solo(solo)
+    pat.update_gains()
+    audi_man._quantIndex = quant_index
+    audi_man._quantLen = audi_man._durLst[quant_index]
+    audi_man._envTable.set_quantizeLen(audi_man._quantLen)
+    audi_man._envTable.set_envelope(*env)
+    audi_man.set_song(Song([pat]))
+    audi_man._curPat = pat
+
+    return pat
+
+#------------------------------------------------------------------------------
+
+def _render_batchJob(job):
+    """
+    render a track of a session alone, at its gain,
+    in its row of the shared memory block
+    """
+    from multiprocessing import shared_memory
+    (session, index, nb_loops, shm_name, nb_tracks, nb_frames) = job
+    audi_man = _batchMan
+    pat = _load_batchSession(session)
+    track = pat.get_track(index)
+    (active_lst, _) = pat.get_activeTracks()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        track_arr = np.ndarray((nb_tracks, nb_frames), dtype=np.float32, buffer=shm.buf)
+        out = track_arr[index]
+        if track not in active_lst:
+            # muted, or not in solo
+            out[:] =0
+        else:
+            for other in pat.get_trackList():
+                other.set_muted(other is not track)
+                other.set_solo(False)
+            pat.update_gains()
+            audi_man.init_params()
+            writer = BufferWriter(out)
+            audi_man.render_offline(nb_loops, writer)
+            out[writer.get_pos():] =0
+        del out, track_arr
+    finally:
+        shm.close()
+    
+    return (session, index)
+
+#========================================
+
 class CommandLine(object):
     def __init__(self):
         self.audi_man = None
+        self._server = None
+        self._lock = threading.Lock() # commands from the prompt and the control server
    
     #-------------------------------------------
 
@@ -973,6 +4557,199 @@ class CommandLine(object):
 
     #-------------------------------------------
 
+    def set_server(self, server):
+        """ control server to show and close with the command line """
+        self._server = server
+
+    #-------------------------------------------
+
+    def parse_command(self, val_str):
+        """ returns (key, param1, param2) of a command string """
+        key = param1 = param2 = ""
+        if val_str == " ":
+            key = val_str
+        else:
+            lst = val_str.split()
+            
+            lenLst = len(lst)
+            if lenLst >0: key = lst[0]
+            if lenLst >1: param1 = lst[1]
+            if lenLst >2: param2 = lst[2]
+
+        return (key, param1, param2)
+
+    #-------------------------------------------
+
+    def exec_command(self, val_str):
+        """
+        execute a command string, returns False for unknown command
+        raises ValueError for invalid parameters
+        """
+        (key, param1, param2) = self.parse_command(val_str)
+        with self._lock:
+            if key == 'p':
+                self.audi_man.play()
+            elif key == 's':
+                self.audi_man.stop()
+            elif key == ' ':
+                self.audi_man.play_pause()
+
+            elif key == "bpm":
+                if not param1: param1 = 120
+                self.audi_man.change_bpm(float(param1), adding=0) # not incremental
+            elif key == 'sb':
+                if not param1: param1 =10
+                self.audi_man.change_bpm(float(param1), adding=1)
+            elif key == 'sB':
+                if not param1: param1 =-10
+                self.audi_man.change_bpm(float(param1), adding=1)
+
+            elif key == "freq":
+                if not param1: param1 =0
+                if not param2: param2 =440
+                self.audi_man.change_freq(int(param1), float(param2), adding=0) # not incremental
+            elif key == 'sf':
+                if not param1: param1 =0
+                if not param2: param2 = 10
+                self.audi_man.change_freq(int(param1), float(param2), adding=1)
+            elif key == 'sF':
+                if not param1: param1 =0
+                if not param2: param2 = -10
+                self.audi_man.change_freq(int(param1), float(param2), adding=1)
+
+            elif key == "note":
+                if not param1: param1 =0
+                if not param2: param2 =69 # A4
+                self.audi_man.change_note(int(param1), int(param2), adding=0) # not incremental
+            elif key == "sn":
+                if not param1: param1 =0
+                if not param2: param2 =1
+                self.audi_man.change_note(int(param1), int(param2), adding=1)
+            elif key == "sN":
+                if not param1: param1 =0
+                if not param2: param2 =-1
+                self.audi_man.change_note(int(param1), int(param2), adding=1)
+
+            elif key == "trs":
+                if not param1: param1 =0
+                self.audi_man.change_transpose(int(param1), adding=0) # not incremental
+            elif key == "st":
+                if not param1: param1 =1
+                self.audi_man.change_transpose(int(param1), adding=1)
+            elif key == "sT":
+                if not param1: param1 =-1
+                self.audi_man.change_transpose(int(param1), adding=1)
+            
+            elif key == "oct":
+                if not param1: param1 =4
+                self.audi_man.change_octave(int(param1), adding=0) # not incremental
+            elif key == "so":
+                if not param1: param1 =1
+                self.audi_man.change_octave(int(param1), adding=1)
+            elif key == "sO":
+                if not param1: param1 =-1
+                self.audi_man.change_octave(int(param1), adding=1)
+
+            elif key == "track":
+                if not param1: self.audi_man.show_tracks()
+                else: self.audi_man.select_track(int(param1))
+            elif key == "addtrack":
+                self.audi_man.add_track()
+            elif key == "gain":
+                if not param1: param1 =0
+                if not param2: param2 =1
+                self.audi_man.change_trackGain(int(param1), float(param2), adding=0)
+            elif key == "mute":
+                if not param1: param1 =0
+                self.audi_man.toggle_mute(int(param1))
+            elif key == "solo":
+                if not param1: param1 =0
+                self.audi_man.toggle_solo(int(param1))
+
+            elif key == "vol":
+                if not param1: param1 =1
+                self.audi_man.change_volume(float(param1), adding=0) # not incremental
+            elif key == "sv":
+                if not param1: param1 =0.1
+                self.audi_man.change_volume(float(param1), adding=1)
+            elif key == "sV":
+                if not param1: param1 =-0.1
+                self.audi_man.change_volume(float(param1), adding=1)
+  
+            elif key == "quant":
+                if not param1: param1 =1
+                self.audi_man.change_quantizeLen(int(param1), adding=0)
+            elif key == "sq":
+                if not param1: param1 =1
+                self.audi_man.change_quantizeLen(int(param1), adding=1)
+            elif key == "sQ":
+                if not param1: param1 =-1
+                self.audi_man.change_quantizeLen(int(param1), adding=1)
+             
+            elif key == "synth":
+                if not param1: param1 = "prerender"
+                self.audi_man.change_synthMode(param1)
+            elif key == "blk":
+                if not param1: param1 =960
+                self.audi_man.change_blockSize(int(param1))
+            elif key == "rate":
+                if not param1: param1 =48000
+                self.audi_man.change_rate(int(param1))
+            elif key == "lat":
+                self.audi_man.show_latency()
+            elif key == "newpat":
+                self.audi_man.new_pattern()
+            elif key == "pat":
+                if not param1: self.audi_man.show_song()
+                else: self.audi_man.select_pattern(int(param1))
+            elif key == "chain":
+                self.audi_man.change_chain(val_str.split()[1:])
+            elif key == "song":
+                self.audi_man.toggle_songMode()
+            elif key == "swap":
+                if not param1: param1 = "step"
+                self.audi_man.set_swapMode(param1)
+            elif key == "act":
+                if not param1: param1 =0
+                self.audi_man.toggle_step(int(param1))
+            elif key == "velo":
+                if not param1: param1 =0
+                if not param2: param2 =1
+                self.audi_man.change_velocity(int(param1), float(param2))
+            elif key == "gate":
+                if not param1: param1 =0
+                if not param2: param2 =1
+                self.audi_man.change_gate(int(param1), float(param2))
+            elif key == "env":
+                self.audi_man.change_envelope(val_str.split()[1:])
+            elif key == "smp":
+                if not param1: param1 =0
+                self.audi_man.change_sample(int(param1), param2)
+            elif key == "save":
+                if not param1: param1 = "/tmp/stepyseq_session"
+                self.audi_man.save_session(param1)
+            elif key == "load":
+                if not param1: param1 = "/tmp/stepyseq_session"
+                self.audi_man.load_session(param1)
+            elif key == "stats":
+                self.audi_man.show_stats(param1, param2)
+            elif key == "cache":
+                self.audi_man.show_cacheInfo()
+            elif key == "bt":
+                self.audi_man.bench_tracks()
+            elif key == "tt":
+                self.audi_man.perf()
+            elif key == "ctl":
+                if self._server: self._server.show_stats()
+            elif key == "test":
+                self.audi_man.test()
+            else:
+                return False
+        
+        return True
+
+    #-------------------------------------------
+
     def mainloop(self):
         filename = _HISTORY_TEMPFILE
         read_historyfile(filename)
@@ -982,113 +4759,18 @@ class CommandLine(object):
 
         try:
             while 1:
-                key = param1 = param2 = ""
                 valStr = input("-> ")
                 if valStr == '': valStr = savStr
                 else: savStr = valStr
-                if valStr == " ":
-                    key = valStr
-                else:
-                    lst = valStr.split()
-                    
-                    lenLst = len(lst)
-                    if lenLst >0: key = lst[0]
-                    if lenLst >1: param1 = lst[1]
-                    if lenLst >2: param2 = lst[2]
+                (key, _, _) = self.parse_command(valStr)
 
                 if key == 'q':
                     print("Bye Bye!!!")
+                    if self._server: self._server.stop()
                     self.audi_man.stop()
                     self.audi_man.close_audioDriver()
                     break
-
-                elif key == 'p':
-                    self.audi_man.play()
-                elif key == 's':
-                    self.audi_man.stop()
-                elif key == ' ':
-                    self.audi_man.play_pause()
-
-                elif key == "bpm":
-                    if not param1: param1 = 120
-                    self.audi_man.change_bpm(float(param1), adding=0) # not incremental
-                elif key == 'sb':
-                    if not param1: param1 =10
-                    self.audi_man.change_bpm(float(param1), adding=1)
-                elif key == 'sB':
-                    if not param1: param1 =-10
-                    self.audi_man.change_bpm(float(param1), adding=1)
-
-                elif key == "freq":
-                    if not param1: param1 =0
-                    if not param2: param2 =440
-                    self.audi_man.change_freq(int(param1), float(param2), adding=0) # not incremental
-                elif key == 'sf':
-                    if not param1: param1 =0
-                    if not param2: param2 = 10
-                    self.audi_man.change_freq(int(param1), float(param2), adding=1)
-                elif key == 'sF':
-                    if not param1: param1 =0
-                    if not param2: param2 = -10
-                    self.audi_man.change_freq(int(param1), float(param2), adding=1)
-
-                elif key == "note":
-                    if not param1: param1 =0
-                    if not param2: param2 =69 # A4
-                    self.audi_man.change_note(int(param1), int(param2), adding=0) # not incremental
-                elif key == "sn":
-                    if not param1: param1 =0
-                    if not param2: param2 =1
-                    self.audi_man.change_note(int(param1), int(param2), adding=1)
-                elif key == "sN":
-                    if not param1: param1 =0
-                    if not param2: param2 =-1
-                    self.audi_man.change_note(int(param1), int(param2), adding=1)
-
-                elif key == "trs":
-                    if not param1: param1 =0
-                    self.audi_man.change_transpose(int(param1), adding=0) # not incremental
-                elif key == "st":
-                    if not param1: param1 =1
-                    self.audi_man.change_transpose(int(param1), adding=1)
-                elif key == "sT":
-                    if not param1: param1 =-1
-                    self.audi_man.change_transpose(int(param1), adding=1)
-                
-                elif key == "oct":
-                    if not param1: param1 =4
-                    self.audi_man.change_octave(int(param1), adding=0) # not incremental
-                elif key == "so":
-                    if not param1: param1 =1
-                    self.audi_man.change_octave(int(param1), adding=1)
-                elif key == "sO":
-                    if not param1: param1 =-1
-                    self.audi_man.change_octave(int(param1), adding=1)
-
-                elif key == "vol":
-                    if not param1: param1 =1
-                    self.audi_man.change_volume(float(param1), adding=0) # not incremental
-                elif key == "sv":
-                    if not param1: param1 =0.1
-                    self.audi_man.change_volume(float(param1), adding=1)
-                elif key == "sV":
-                    if not param1: param1 =-0.1
-                    self.audi_man.change_volume(float(param1), adding=1)
-  
-                elif key == "quant":
-                    if not param1: param1 =1
-                    self.audi_man.change_quantizeLen(int(param1), adding=0)
-                elif key == "sq":
-                    if not param1: param1 =1
-                    self.audi_man.change_quantizeLen(int(param1), adding=1)
-                elif key == "sQ":
-                    if not param1: param1 =-1
-                    self.audi_man.change_quantizeLen(int(param1), adding=1)
-                 
-                elif key == "tt":
-                    self.audi_man.perf()
-                elif key == "test":
-                    self.audi_man.test()
+                self.exec_command(valStr)
         finally:
             write_historyfile(filename)
 
@@ -1096,8 +4778,195 @@ class CommandLine(object):
 
 #========================================
 
+class ControlServer(object):
+    """
+    asyncio server of the command line commands, on loopback UDP or UNIX datagram socket,
+    in its own thread. A message holds one or more commands, separated by newlines or ";",
+    with OSC style addresses: "/bpm 140; /note 0 60".
+    The commands are executed in order by a worker thread, not blocking the loop.
+    Each message is answered with "ok" or the errors, and its processing time
+    """
+    def __init__(self, com, addr="udp:127.0.0.1:9000"):
+        self._com = com
+        self._addr = addr
+        self._loop = None
+        self._executor = None
+        self._thread = None
+        self._transport = None
+        self._unixPath = ""
+        self._ready = threading.Event()
+        self._error = None
+        self._nbMessages =0
+        self._nbCommands =0
+        self._nbErrors =0
+        self._totalNs =0
+        self._maxNs =0
+
+    #-------------------------------------------
+
+    def parse_addr(self, addr):
+        """ returns (family, local_addr) from udp:host:port or unix:path """
+        import socket
+        (kind, _, rest) = addr.partition(":")
+        if kind == "unix":
+            return (socket.AF_UNIX, rest)
+        elif kind == "udp":
+            (host, _, port) = rest.rpartition(":")
+            return (socket.AF_INET, (host or "127.0.0.1", int(port)))
+        raise ValueError(f"Control address not supported: {addr}")
+
+    #-------------------------------------------
+
+    def start(self):
+        """ open the socket in the server thread, raises its error """
+        self._thread = threading.Thread(target=self._run_thread, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error:
+            self._thread = None
+            raise self._error
+
+    #-------------------------------------------
+
+    def _run_thread(self):
+        # only needed by the control server
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        loop = self._loop = asyncio.new_event_loop()
+        # one worker, the messages executed in their arrival order
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            loop.run_until_complete(self.open_endpoint())
+        except (OSError, ValueError) as err:
+            self._error = err
+            loop.close()
+            self._executor.shutdown()
+            return
+        finally:
+            self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._transport.close()
+            loop.close()
+            # the command running ends, the waiting ones are dropped
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            if self._unixPath and os.path.exists(self._unixPath):
+                os.unlink(self._unixPath)
+
+    #-------------------------------------------
+
+    async def open_endpoint(self):
+        (family, addr) = self.parse_addr(self._addr)
+        if isinstance(addr, str):
+            # socket file left by a previous run
+            if os.path.exists(addr): os.unlink(addr)
+            self._unixPath = addr
+        await self._loop.create_datagram_endpoint(lambda: self, local_addr=addr, family=family)
+
+    #-------------------------------------------
+
+    def stop(self):
+        if self._thread is None: return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    #-------------------------------------------
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    #-------------------------------------------
+
+    def connection_lost(self, exc):
+        pass
+
+    #-------------------------------------------
+
+    def error_received(self, exc):
+        self._nbErrors +=1
+
+    #-------------------------------------------
+
+    def split_message(self, data):
+        """ returns list of the commands of a message """
+        cmd_lst = []
+        for cmd in data.decode("utf-8", "replace").replace(";", "\n").splitlines():
+            cmd = cmd.strip()
+            if cmd.startswith("/"): cmd = cmd[1:]
+            if cmd: cmd_lst.append(cmd)
+
+        return cmd_lst
+
+    #-------------------------------------------
+
+    def datagram_received(self, data, addr):
+        """ execute the commands of a message in the worker, and answer to the sender """
+        fut = self._loop.run_in_executor(self._executor, self.exec_message, data)
+        fut.add_done_callback(lambda fut: self.send_answer(fut, addr))
+
+    #-------------------------------------------
+
+    def exec_message(self, data):
+        """ execute the commands of a message, returns the answer """
+        start = time.perf_counter_ns()
+        err_lst = []
+        for cmd in self.split_message(data):
+            try:
+                if not self._com.exec_command(cmd):
+                    err_lst.append(f"unknown command: {cmd}")
+            except Exception as err:
+                # a bad message does not stop the server
+                err_lst.append(f"{cmd}: {err}")
+            self._nbCommands +=1
+        dur = time.perf_counter_ns() - start
+        self._nbMessages +=1
+        self._nbErrors += len(err_lst)
+        self._totalNs += dur
+        self._maxNs = max(self._maxNs, dur)
+        msg = "; ".join(err_lst) if err_lst else "ok"
+
+        return f"{msg} {dur / 1000:.1f} usec"
+
+    #-------------------------------------------
+
+    def send_answer(self, fut, addr):
+        """ answer to the sender, in the loop """
+        if not addr or fut.cancelled(): return
+        self._transport.sendto(fut.result().encode(), addr)
+
+    #-------------------------------------------
+
+    def get_stats(self):
+        nb = max(1, self._nbMessages)
+        return {
+                "messages": self._nbMessages,
+                "commands": self._nbCommands,
+                "errors": self._nbErrors,
+                "mean_us": self._totalNs / nb / 1000,
+                "max_us": self._maxNs / 1000,
+                }
+
+    #-------------------------------------------
+
+    def show_stats(self):
+        dic = self.get_stats()
+        audi_man = self._com.audi_man
+        msg = (f"Control {self._addr}: {dic['messages']} messages, {dic['commands']} commands, "
+                f"{dic['errors']} errors, mean: {dic['mean_us']:.1f} usec, max: {dic['max_us']:.1f} usec\n"
+                f"Edit to swap: {audi_man.get_swapLatency() * 1000:.2f} msec, "
+                f"output latency: {audi_man.get_latency() * 1000:.2f} msec")
+        audi_man.print_info(msg)
+
+    #-------------------------------------------
+
+#========================================
+
 class MainWindow(object):
     def __init__(self):
+        global curses
+        import curses
         self.stdscr = curses.initscr()
         curses.noecho() # don't repeat key hit at the screen
         # curses.cbreak()
@@ -1214,21 +5083,24 @@ class MainWindow(object):
 
 
 class MainApp(object):
-    def __init__(self):
-        self.audi_man = AudioManager()
+    def __init__(self, driver="port", ring_frames=0, rate=48000, frame_count=960, **driver_args):
+        self.audi_man = AudioManager(driver, ring_frames, rate, frame_count, **driver_args)
         self._com = CommandLine()
         self._win = None
         # self._win = MainWindow()
 
     #-------------------------------------------
    
-    def init_app(self):
+    def init_app(self, session=""):
         """
         init application
         from MainApp object
         """
         self.audi_man.init_audioDriver()
-        self.audi_man.init_pattern()
+        if session:
+            self.audi_man.load_session(session)
+        else:
+            self.audi_man.init_pattern()
         self._com.set_audiMan(self.audi_man)
         # self._win.set_audiMan(self.audi_man)
 
@@ -1244,12 +5116,46 @@ class MainApp(object):
     #------------------------------------------------------------------------------
 
    
-    def main(self):
-        self.init_app()
+    def main(self, session="", control=""):
+        self.init_app(session)
+        if control:
+            server = ControlServer(self._com, control)
+            server.start()
+            self._com.set_server(server)
+            print(f"Control server on {control}")
         self._com.mainloop()
 
     #-------------------------------------------
 
+    def bounce(self, filename, nb_loops=1, bpm=120, session=""):
+        """
+        render offline the pattern to wav file, without opening the audio driver
+        from MainApp object
+        """
+        if session:
+            self.audi_man.load_session(session)
+        else:
+            self.audi_man.init_pattern(bpm)
+        start = time.perf_counter()
+        nb_frames = self.audi_man.bounce(filename, nb_loops)
+        dur = time.perf_counter() - start
+        secs = nb_frames / self.audi_man._rate
+        print(f"Bounced {secs:.2f} secs to {filename} in {dur:.3f} secs")
+
+    #-------------------------------------------
+
+    def bounce_batch(self, session_lst, out_dir="", nb_loops=1, nb_procs=0):
+        """
+        render offline session files to wav files, in parallel processes
+        from MainApp object
+        """
+        start = time.perf_counter()
+        out_lst = self.audi_man.render_batch(session_lst, out_dir, nb_loops, nb_procs)
+        dur = time.perf_counter() - start
+        print(f"Bounced {len(out_lst)} sessions in {dur:.3f} secs")
+
+    #-------------------------------------------
+
     def test(self):
         pass
             
@@ -1257,8 +5163,64 @@ class MainApp(object):
 
 #========================================
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prototype for Step Sequencer")
+    parser.add_argument("-b", "--bounce", metavar="FILE",
+            help="render offline the pattern to a wav file and exit")
+    parser.add_argument("-l", "--loops", type=int, default=1,
+            help="number of pattern loops to bounce")
+    parser.add_argument("--bpm", type=float, default=120,
+            help="tempo of the pattern")
+    parser.add_argument("-S", "--session", metavar="FILE", default="",
+            help="session file to load, instead of the default pattern")
+    parser.add_argument("-B", "--batch", metavar="FILE", nargs="+",
+            help="render offline the session files to wav files, in parallel, and exit")
+    parser.add_argument("--outdir", default="",
+            help="directory of the batch wav files, the sessions one by default")
+    parser.add_argument("-j", "--procs", type=int, default=0,
+            help="number of batch processes, the cpu count by default")
+    parser.add_argument("-C", "--control", metavar="ADDR", default="",
+            help="control server address: udp:127.0.0.1:9000 or unix:/tmp/stepyseq.sock")
+    parser.add_argument("-d", "--driver", choices=sorted(_driverDic), default="port",
+            help="audio driver: port for sound card, null or file for headless")
+    parser.add_argument("-o", "--output", default="/tmp/stepyseq_out.wav",
+            help="wav file for the file driver")
+    parser.add_argument("-r", "--realtime", action="store_true",
+            help="pace the null and file drivers to realtime")
+    parser.add_argument("-s", "--synth", choices=["prerender", "stream"], default="prerender",
+            help="synth mode: steps audio prerendered in memory, or generated on the fly")
+    parser.add_argument("--rate", type=int, default=48000,
+            help="sample rate of the engine")
+    parser.add_argument("-k", "--block", type=int, default=960, metavar="FRAMES",
+            help="block size of the engine, from 64 to 4096 frames")
+    parser.add_argument("--ring", type=int, default=0, metavar="FRAMES",
+            help="ring buffer capacity in frames, between renderer and driver")
+    
+    return parser.parse_args(argv)
+
+#------------------------------------------------------------------------------
+
+def get_driverArgs(args):
+    """ returns the driver arguments from the command line arguments """
+    driver_args = {}
+    if args.driver in ("null", "file"):
+        driver_args["realtime"] = args.realtime
+    if args.driver == "file":
+        driver_args["filename"] = args.output
+    
+    return driver_args
+
+#------------------------------------------------------------------------------
+
 if __name__ == "__main__":
-    app = MainApp()
-    app.main()
+    args = parse_args()
+    app = MainApp(args.driver, args.ring, args.rate, args.block, **get_driverArgs(args))
+    app.audi_man.set_synthMode(args.synth)
+    if args.batch:
+        app.bounce_batch(args.batch, args.outdir, args.loops, args.procs)
+    elif args.bounce:
+        app.bounce(args.bounce, args.loops, args.bpm, args.session)
+    else:
+        app.main(args.session, args.control)
 #------------------------------------------------------------------------------
 